@@ -1,219 +1,83 @@
 import json
-import pathlib
+import re
+import uuid
 
 import gradio as gr
 
-from service.holder import ChatMessage, User, Holder, AIHolder, Bot, ChatMessageList, UserHolder, RoundRobin, Switch, \
-    Random, HotPotato
-from service.llm import test_connection
-
-
-def init_switch(meeting, progress):
-    participants = meeting["participants"]
-    meeting_prompt = meeting["meeting_prompt"]
-    me = meeting["who_am_i"]
-    readme = meeting["readme"]
-
-    msg_list = ChatMessageList()
-    user = User(name=me["name"], title=me["title"], prompt=me["prompt"])
-
-    switch = Switch(user=user, msg_list=msg_list)
-    switch.share_msg_with(user)
-    the_holder = Holder.new_meeting(
-        switch, about=meeting["objective"])
-
-    for p in participants:
-        participants[p]["prompt"] = f"{participants[p]['prompt']}\n{meeting_prompt}"
-        ml = ChatMessageList()
-        bot = Bot(**participants[p], msg_list=ml)
-        the_holder.add_participant(bot)
-
-    progress(0.4)
-    the_holder.holder_note.append(dict(event="meeting_started", result=test_connection()))
-    progress(0.8)
-    return the_holder, user, gr.update(label=the_holder.meeting_about, visible=True), "\n".join(
-        [f"{p}({participants[p]['title']})" for p in participants]) + "\n\n\n-------------------\n" + readme
-
-
-def init_hot_potato(meeting, progress):
-    participants = meeting["participants"]
-    meeting_prompt = meeting["meeting_prompt"]
-    readme = meeting["readme"]
-
-    msg_list = ChatMessageList()
-    ai_holder = HotPotato(msg_list=msg_list, choice_prompt=meeting["strategy"]["choice_prompt"])
-    the_holder = Holder.new_meeting(
-        ai_holder, about=meeting["objective"])
-    me = meeting["who_am_i"]
-    user = User(name=me["name"], title=me["title"], prompt=me["prompt"])
-    ai_holder.share_msg_with(user)
-    the_holder.add_participant(user)
-
-    for p in participants:
-        participants[p]["prompt"] = f"{participants[p]['prompt']}\n{meeting_prompt}"
-        bot = Bot(**participants[p])
-        ai_holder.share_msg_with(bot)
-        the_holder.add_participant(bot)
-    progress(0.4)
-    the_holder.holder_note.append(dict(event="meeting_started", result=test_connection()))
-    progress(0.8)
-    return the_holder, user, gr.update(label=the_holder.meeting_about, visible=True), "\n".join(
-        [f"{p}({participants[p]['title']})" for p in participants]) + "\n\n\n-------------------\n" + readme
-
-
-def init_random(meeting, progress):
-    participants = meeting["participants"]
-    meeting_prompt = meeting["meeting_prompt"]
-    me = meeting["who_am_i"]
-    readme = meeting["readme"]
-    factor = meeting["strategy"]["factor"]
-    random_plot = meeting["strategy"]["random_plot"]
-
-    msg_list = ChatMessageList()
-    user = User(name=me["name"], title=me["title"], prompt=me["prompt"])
-
-    random = Random(user=user, msg_list=msg_list, factor=factor, random_plot=random_plot)
-    random.share_msg_with(user)
-    the_holder = Holder.new_meeting(
-        random, about=meeting["objective"])
-
-    for p in participants:
-        participants[p]["prompt"] = f"{participants[p]['prompt']}\n{meeting_prompt}"
-        bot = Bot(**participants[p])
-        random.share_msg_with(bot)
-        the_holder.add_participant(bot)
-
-    progress(0.4)
-    the_holder.holder_note.append(dict(event="meeting_started", result=test_connection()))
-    progress(0.8)
-    return the_holder, user, gr.update(label=the_holder.meeting_about, visible=True), "\n".join(
-        [f"{p}({participants[p]['title']})" for p in participants]) + "\n\n\n-------------------\n" + readme
-
-
-def init_round_robin(meeting, progress):
-    participants = meeting["participants"]
-    meeting_prompt = meeting["meeting_prompt"]
-    me = meeting["who_am_i"]
-    readme = meeting["readme"]
-
-    sequence = meeting["sequence"]
-    default_seq = list(participants.keys())
-    if sequence:
-        default_seq = sequence
-    msg_list = ChatMessageList()
-    robin = RoundRobin(sequence=default_seq, msg_list=msg_list)
-    the_holder = Holder.new_meeting(
-        robin, about=meeting["objective"])
-    user = User(name=me["name"], title=me["title"], prompt=me["prompt"])
-    robin.share_msg_with(user)
-    for p in participants:
-        participants[p]["prompt"] = f"{participants[p]['prompt']}\n{meeting_prompt}"
-        bot = Bot(**participants[p])
-        robin.share_msg_with(bot)
-        the_holder.add_participant(bot)
-    progress(0.4)
-    the_holder.holder_note.append(dict(event="meeting_started", result=test_connection()))
-    progress(0.8)
-    return the_holder, user, gr.update(label=the_holder.meeting_about, visible=True), "\n".join(
-        [f"{p}({participants[p]['title']})" for p in participants]) + "\n\n\n-------------------\n" + readme
-
-
-def init_ai_holder_meeting(meeting, progress):
-    holder = meeting["strategy"]["holder"]
-    participants = meeting["participants"]
-    meeting_prompt = meeting["meeting_prompt"]
-    readme = meeting["readme"]
-
-    if type(holder) == str:
-        holder_bot = Bot(**participants[holder])
-    else:
-        holder_bot = Bot(**holder)
-    holder_bot.prompt = f"{holder_bot.prompt}\n{meeting_prompt}"
-    msg_list = ChatMessageList()
-    ai_holder = AIHolder(msg_list=msg_list, holder=holder_bot, choice_prompt=meeting["strategy"]["choice_prompt"])
-    the_holder = Holder.new_meeting(
-        ai_holder, about=meeting["objective"])
-    ai_holder.share_msg_with(holder_bot)
-    me = meeting["who_am_i"]
-    user = User(name=me["name"], title=me["title"], prompt=me["prompt"])
-    ai_holder.share_msg_with(user)
-    the_holder.add_participant(user)
-
-    for p in participants:
-        participants[p]["prompt"] = f"{participants[p]['prompt']}\n{meeting_prompt}"
-        bot = Bot(**participants[p])
-        ai_holder.share_msg_with(bot)
-        the_holder.add_participant(bot)
-    progress(0.4)
-    the_holder.holder_note.append(dict(event="meeting_started", result=test_connection()))
-    progress(0.8)
-    return the_holder, user, gr.update(label=the_holder.meeting_about, visible=True), "\n".join(
-        [f"{p}({participants[p]['title']})" for p in participants]) + "\n\n\n-------------------\n" + readme
-
-
-def init_user_holder_meeting(meeting, progress):
-    participants = meeting["participants"]
-    meeting_prompt = meeting["meeting_prompt"]
-    me = meeting["who_am_i"]
-    readme = meeting["readme"]
-    user = User(name=me["name"], title=me["title"], prompt=me["prompt"])
-
-    msg_list = ChatMessageList()
-    user_holder = UserHolder(msg_list=msg_list, holder=user)
-    the_holder = Holder.new_meeting(user_holder, about=meeting["objective"])
-    user_holder.share_msg_with(user)
-
-    for p in participants:
-        participants[p]["prompt"] = f"{participants[p]['prompt']}\n{meeting_prompt}"
-        bot = Bot(**participants[p])
-        user_holder.share_msg_with(bot)
-        the_holder.add_participant(bot)
-    progress(0.4)
-    the_holder.holder_note.append(dict(event="meeting_started", result=test_connection()))
-    progress(0.8)
-    return the_holder, user, gr.update(label=the_holder.meeting_about, visible=True), "\n".join(
-        [f"{p}({participants[p]['title']})" for p in participants]) + "\n\n\n-------------------\n" + readme
-
-
-def create_meeting(meeting_name, meeting_setting, room, progress=gr.Progress()):
-    if not meeting_setting:
-        raise gr.Error("请先从下面选择一个会议")
+import setting
+from service import metrics
+from service.health import health
+from service.holder import ChatMessage
+from service.meeting import pool
+from service.preset import catalog
+from service.render import coalesce
+from service.session import RoomMismatch, SessionBusy, sessions
+
 
-    meeting_setting = json.loads(meeting_setting)
-    selected_meeting = meeting_setting["meeting"][meeting_name]
+def create_meeting(room, overrides, meeting_id, progress=gr.Progress()):
+    if not room:
+        raise gr.Error("请先从下面选择一个会议")
+    # only what was edited comes from the browser, a json merge patch over the preset
+    try:
+        selected_meeting = catalog.get(room, json.loads(overrides or "{}"))
+        # a preset id and its meeting name are the same room
+        room = catalog.name(room)
+    except KeyError:
+        raise gr.Error(f"没有这个会议: {room}")
+    except ValueError as e:
+        # bad json and a preset that no longer validates after the overrides
+        raise gr.Error(f"会议配置有误: {e}")
+    meeting_id = meeting_id.strip() or uuid.uuid4().hex[:12]
+    if not re.fullmatch(r"[\w-]+", meeting_id):
+        raise gr.Error("会议id只能包含字母,数字,下划线和-")
     progress(0.1)
-    match selected_meeting["strategy"]["type"]:
-        case "aiholder" | "AIHolder" | "ai主持":
-            holder, user, about, parti = init_ai_holder_meeting(selected_meeting, progress)
-            return holder, user, about, parti, True, gr.update(value="会议已开始", interactive=False), room, [
-                (None, holder.desc_meeting())], gr.update(placeholder="enter text", interactive=True)
-        case "userholder" | "UserHolder" | "用户主持":
-            holder, user, about, parti = init_user_holder_meeting(selected_meeting, progress)
-            return holder, user, about, parti, True, gr.update(value="会议已开始", interactive=False), room, [
-                (None, holder.desc_meeting())], gr.update(placeholder="enter text", interactive=True)
-        case "roundrobin" | "RoundRobin" | "击鼓传花":
-            holder, user, about, parti = init_round_robin(selected_meeting, progress)
-            return holder, user, about, parti, True, gr.update(value="会议已开始", interactive=False), room, [
-                (None, holder.desc_meeting())], gr.update(placeholder="enter text", interactive=True)
-        case "switch" | "Switch" | "简单并发":
-            holder, user, about, parti = init_switch(selected_meeting, progress)
-            return holder, user, about, parti, True, gr.update(value="会议已开始", interactive=False), room, [
-                (None, holder.desc_meeting())], gr.update(placeholder="enter text", interactive=True)
-        case "random" | "Random" | "随机":
-            holder, user, about, parti = init_random(selected_meeting, progress)
-            return holder, user, about, parti, True, gr.update(value="会议已开始", interactive=False), room, [
-                (None, holder.desc_meeting())], gr.update(placeholder="enter text", interactive=True)
-        case "hotpotato" | "HotPotato" | "丢手绢":
-            holder, user, about, parti = init_hot_potato(selected_meeting, progress)
-            return holder, user, about, parti, True, gr.update(value="会议已开始", interactive=False), room, [
-                (None, holder.desc_meeting())], gr.update(placeholder="enter text", interactive=True)
-        case _:
-            raise ValueError("no such strategy")
-
-
-def add_text(holder, user, text):
-    holder.input(ChatMessage(user_name=user.name, supplement=user.title, content=text))
-    return user.view(), "", gr.update(visible=False), gr.update(visible=True), gr.update(
+    try:
+        session = sessions.create(meeting_id, selected_meeting, progress, room=room)
+    except SessionBusy:
+        raise gr.Error(f"会议 {meeting_id} 正在另一个页面进行中")
+    except RoomMismatch:
+        raise gr.Error(f"会议 {meeting_id} 是在另一个会议室开始的,请换一个会议id")
+    holder = session.holder
+    about = gr.update(label=holder.meeting_about, visible=True)
+    holder.note("meeting id", meeting_id)
+    # a resumed meeting shows what was said before
+    return meeting_id, about, session.participants, True, gr.update(value="会议已开始", interactive=False), \
+        gr.update(value=room, interactive=False), \
+        session.renderer.frame() + [(None, holder.desc_meeting())], \
+        gr.update(placeholder="enter text", interactive=True)
+
+
+def refresh_rooms(seen):
+    """
+    the rooms of the catalog as it is now, sent only when they changed since the last refresh
+    """
+    rooms = catalog.rooms()
+    if rooms == seen:
+        return gr.update(), seen
+    return gr.update(choices=rooms), rooms
+
+
+def show_preset(room):
+    if not room:
+        return ""
+    try:
+        return json.dumps(catalog.source(room), indent=4, ensure_ascii=False)
+    except KeyError:
+        return ""
+
+
+def live_session(session_id):
+    session = sessions.get(session_id)
+    if session is None:
+        raise gr.Error("会议已经结束,请重新开始会议")
+    return session
+
+
+def add_text(session_id, text):
+    session = live_session(session_id)
+    user = session.user
+    session.holder.input(ChatMessage(user_name=user.name, supplement=user.title, content=text))
+    return session.renderer.frame(), "", gr.update(visible=False), gr.update(visible=True), gr.update(
         visible=True)
 
 
@@ -221,15 +85,64 @@ def after_bot():
     return gr.update(visible=True), gr.update(visible=False), gr.update(visible=False)
 
 
-def on_chatbot_answer(holder, user, history):
-    for lines in holder.starts():
-        # cache this
-        history = user.view()
-        for msg in lines:
-            history.append((None, f"{msg[0]}: {msg[1]}"))
-        yield history
-
-    yield user.view()
+def on_chatbot_answer(session_id):
+    session = live_session(session_id)
+    # only busy() raises SessionBusy, when another tab is running a round of this meeting
+    try:
+        with session.busy():
+            if setting.stream_coalesce:
+                frames = coalesce(session.holder.starts(tick=setting.stream_coalesce["interval"]),
+                                  **setting.stream_coalesce)
+            else:
+                frames = session.holder.starts()
+            for lines in frames:
+                session.touch()
+                if lines is not None and not lines:
+                    # the end of a round, a restart picks the meeting up from here
+                    session.save()
+                yield session.renderer.frame(lines)
+    except SessionBusy:
+        raise gr.Error("这场会议正在另一个页面进行中,请稍后再试")
+
+    yield session.renderer.frame()
+
+
+# appends the lines display_log sends to the events tab, the browser keeps the ones it has
+APPEND_EVENTS = """
+(delta) => {
+    const app = document.querySelector("gradio-app");
+    const box = ((app && app.shadowRoot) || document).querySelector("#event-lines");
+    if (!box || !delta) return [];
+    if (delta.reset) box.replaceChildren();
+    for (const line of delta.lines) {
+        const p = document.createElement("p");
+        p.textContent = line;
+        box.appendChild(p);
+    }
+    while (box.childElementCount > delta.keep) box.firstElementChild.remove();
+    return [];
+}
+"""
+
+
+def display_log(session_id, seen):
+    """
+    only what changed since the last poll: the new events by cursor, the status and metrics when
+    they changed. seen is (session id, cursor, status version) of what the browser shows
+    """
+    # polling the log neither keeps a meeting alive nor restores a spilled one
+    session = sessions.get(session_id, touch=False)
+    if session is None:
+        return gr.update(), gr.update(), seen
+    holder = session.holder
+    reset = seen is None or seen[0] != session_id
+    cursor, shown = (0, None) if reset else seen[1:]
+    lines, cursor = holder.log_since(cursor)
+    delta = dict(reset=reset, lines=lines, seq=cursor, keep=setting.event_log_size) \
+        if lines or reset else gr.update()
+    version = holder.status_version()
+    status = holder.to_display_status() if version != shown else gr.update()
+    return delta, status, (session_id, cursor, version)
 
 
 def wait_btn_click(state):
@@ -242,10 +155,10 @@ def send_btn_click(state):
 
 with gr.Blocks(title="About what", css="./asset/style.css", theme=gr.themes.Monochrome()) as chat_team_app:
     waiting = gr.State(False)
-    meeting_holder = gr.State(None)  # may run into a race contition due to multi-threading
-    user_p = gr.State(None)  # may run into a race contition due to multi-threading
-    my_preset = json.loads(pathlib.Path("./asset/preset.json").read_text(encoding="utf-8"))
-    cfg = gr.State(json.dumps(my_preset, indent=4, ensure_ascii=False))
+    # the meeting itself stays on the server, see service.session
+    session_id = gr.State(None)
+    # what the events tab shows, see display_log
+    log_seen = gr.State(None)
 
     with gr.Row():
         with gr.Column(scale=6):
@@ -268,49 +181,66 @@ with gr.Blocks(title="About what", css="./asset/style.css", theme=gr.themes.Mono
             hello = gr.State(False)
 
 
-            def on_hand_up(holder):
-                holder.user_raised_hand()
+            def on_hand_up(session_id):
+                live_session(session_id).holder.user_raised_hand()
 
 
-            def on_cancel(holder):
-                holder.user_cancel()
+            def on_cancel(session_id):
+                live_session(session_id).holder.user_cancel()
 
         meeting_started = gr.State(False)
 
         with gr.Column(scale=4):
             with gr.Row(elem_id="setting-panel"):
                 with gr.Tab("会议室"):
-                    selected_room = gr.Text(label="当前会议", interactive=False)
-                    exp = gr.Examples(examples=my_preset["room"], label="可选会议", inputs=selected_room)
+                    # the choices follow the preset files, see refresh_rooms
+                    selected_room = gr.Dropdown(choices=catalog.rooms(), label="当前会议")
+                    rooms_seen = gr.State(catalog.rooms())
                     start_meeting_btn = gr.Button("开始会议")
                     participant = gr.TextArea(lines=10, visible=False)
 
                 with gr.Tab("会议配置"):
-                    meeting_config = gr.TextArea(label="会议配置",
-                                                 value=cfg.value,
-                                                 interactive=True, lines=30)
+                    meeting_overrides = gr.TextArea(label="修改(json merge patch,只写要改的部分)",
+                                                    value="{}", interactive=True, lines=8)
+                    meeting_config = gr.Code(label="会议配置", language="json", interactive=False)
 
                 with gr.Tab("设置"):
+                    meeting_id = gr.Textbox(label="会议id", placeholder="留空则新建会议,填入之前的会议id可以继续那场会议")
                     # gr.Textbox(label="api-key")
                     # gr.Dropdown(["en", "中文"], label="语言")
                     ...
                 with gr.Tab("事件"):
-                    logs = gr.Markdown(label="事件", interactive=False)
-
-        start_meeting_btn.click(create_meeting, [selected_room, meeting_config, selected_room],
-                                [meeting_holder, user_p, participant, participant, meeting_started, start_meeting_btn,
+                    log_status = gr.Markdown()
+                    gr.HTML('<div id="event-lines"></div>')
+                    # never shown, display_log sends the new events through it to APPEND_EVENTS
+                    log_delta = gr.JSON(visible=False)
+
+        selected_room.change(show_preset, [selected_room], [meeting_config])
+        chat_team_app.load(refresh_rooms, [rooms_seen], [selected_room, rooms_seen], every=5)
+        start_meeting_btn.click(create_meeting, [selected_room, meeting_overrides, meeting_id],
+                                [session_id, participant, participant, meeting_started,
+                                 start_meeting_btn,
                                  selected_room,
                                  chatbot,
                                  user_input]).then(
-            lambda x: x.to_display_log(), [meeting_holder], [logs], every=0.5)
+            display_log, [session_id, log_seen], [log_delta, log_status, log_seen], every=0.5)
+        log_delta.change(None, [log_delta], [], _js=APPEND_EVENTS)
 
-        user_input.submit(add_text, [meeting_holder, user_p, user_input], [chatbot, user_input, send, col1, col2]) \
-            .then(on_chatbot_answer, [meeting_holder, user_p, chatbot], [chatbot]) \
+        user_input.submit(add_text, [session_id, user_input],
+                          [chatbot, user_input, send, col1, col2]) \
+            .then(on_chatbot_answer, [session_id], [chatbot]) \
             .then(after_bot, [], [send, col1, col2])
-        send.click(add_text, [meeting_holder, user_p, user_input], [chatbot, user_input, send, col1, col2]) \
-            .then(on_chatbot_answer, [meeting_holder, user_p, chatbot], [chatbot]) \
+        send.click(add_text, [session_id, user_input],
+                          [chatbot, user_input, send, col1, col2]) \
+            .then(on_chatbot_answer, [session_id], [chatbot]) \
             .then(after_bot, [], [send, col1, col2])
 
-        hand_up.click(on_hand_up, [meeting_holder], [])
-        cancel.click(on_cancel, [meeting_holder], [])
+        hand_up.click(on_hand_up, [session_id], [])
+        cancel.click(on_cancel, [session_id], [])
+health.start()
+sessions.start()
+pool.prewarm(catalog)
+catalog.listeners.append(pool.prewarm)
+if setting.metrics_port:
+    metrics.serve(setting.metrics_port)
 chat_team_app.queue(concurrency_count=100).launch(server_port=8000, server_name="0.0.0.0")
@@ -0,0 +1,184 @@
+import threading
+import time
+from typing import Dict, List
+
+import openai
+
+import setting
+from .events import emit
+
+
+class Backend:
+    """
+    one api key / endpoint, with the load and health numbers the pool routes on
+    """
+
+    def __init__(self, name: str, api_key: str | None = None, api_base: str | None = None, model: str | None = None,
+                 weight: float = 1):
+        self.name = name
+        self.api_key = api_key
+        self.api_base = api_base
+        self.model = model
+        self.weight = weight
+        self.inflight = 0
+        self.latency = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.errors_in_row = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def serves(self, model: str | None) -> bool:
+        return model is None or self.model is None or self.model == model
+
+    def healthy(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def load(self) -> float:
+        # a backend nobody has measured yet is assumed to answer in a second
+        return (self.inflight + 1) / self.weight * (self.latency or 1.0)
+
+    def request_kwargs(self, kwargs: Dict) -> Dict:
+        kwargs = dict(kwargs)
+        if self.api_key:
+            kwargs["api_key"] = self.api_key
+        if self.api_base:
+            kwargs["api_base"] = self.api_base
+        if self.model and not self.serves(kwargs.get("model")):
+            kwargs["model"] = self.model
+        return kwargs
+
+    def desc(self) -> str:
+        state = "up" if self.healthy(time.time()) else "ejected"
+        return f"{self.name}: {state}, {self.inflight} in flight, {self.latency * 1000:.0f}ms, " \
+               f"{self.failures}/{self.requests} failed"
+
+
+class BackendPool:
+    """
+    routes every request to the least loaded healthy backend. a backend failing eject_after times
+    in a row sits out for eject_for seconds (doubling on every ejection) before it gets traffic again
+    """
+
+    def __init__(self, backends: List[Backend], eject_after: int = 3, eject_for: float = 30, max_eject_for=600):
+        self.backends = {b.name: b for b in backends}
+        self.eject_after = eject_after
+        self.eject_for = eject_for
+        self.max_eject_for = max_eject_for
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_setting(cls):
+        if not setting.backends:
+            return cls([Backend("default")])
+        return cls([Backend(**b) for b in setting.backends])
+
+    def pick(self, pin: str | None = None, model: str | None = None) -> Backend:
+        with self.lock:
+            if pin is not None:
+                if pin not in self.backends:
+                    raise ValueError(f"no such backend {pin}")
+                backend = self.backends[pin]
+            else:
+                now = time.time()
+                serving = [b for b in self.backends.values() if b.serves(model)] or list(self.backends.values())
+                healthy = [b for b in serving if b.healthy(now)]
+                if healthy:
+                    backend = min(healthy, key=Backend.load)
+                else:
+                    # everyone is out, try the one that comes back first
+                    backend = min(serving, key=lambda b: b.ejected_until)
+            backend.inflight += 1
+            backend.requests += 1
+            return backend
+
+    def succeeded(self, backend: Backend, latency: float | None = None):
+        with self.lock:
+            if latency is not None:
+                backend.latency = latency if not backend.latency else backend.latency * 0.8 + latency * 0.2
+            if backend.errors_in_row or not backend.healthy(time.time()):
+                emit("backend recovered", backend.name)
+            backend.errors_in_row = 0
+            backend.ejections = 0
+            backend.ejected_until = 0
+
+    def failed(self, backend: Backend, e: Exception):
+        if isinstance(e, openai.error.InvalidRequestError):
+            # the request was bad, not the backend
+            return
+        with self.lock:
+            backend.failures += 1
+            backend.errors_in_row += 1
+            if backend.errors_in_row >= self.eject_after and backend.healthy(time.time()):
+                cooldown = min(self.max_eject_for, self.eject_for * 2 ** backend.ejections)
+                backend.ejections += 1
+                backend.ejected_until = time.time() + cooldown
+                emit("backend ejected", f"{backend.name} for {cooldown:.0f}s after {type(e).__name__}")
+
+    def release(self, backend: Backend):
+        with self.lock:
+            backend.inflight -= 1
+
+    def create(self, kwargs: Dict, pin: str | None = None):
+        backend = self.pick(pin, kwargs.get("model"))
+        point = time.time()
+        try:
+            resp = openai.ChatCompletion.create(**backend.request_kwargs(kwargs))
+        except Exception as e:
+            self.failed(backend, e)
+            self.release(backend)
+            raise
+        if not kwargs.get("stream"):
+            self.succeeded(backend, time.time() - point)
+            self.release(backend)
+            return resp
+        return self._track(backend, resp, point)
+
+    def _track(self, backend: Backend, stream, point: float):
+        first = True
+        try:
+            for chunk in stream:
+                if first:
+                    self.succeeded(backend, time.time() - point)
+                    first = False
+                yield chunk
+        except Exception as e:
+            self.failed(backend, e)
+            raise
+        finally:
+            self.release(backend)
+
+    async def acreate(self, kwargs: Dict, pin: str | None = None):
+        backend = self.pick(pin, kwargs.get("model"))
+        point = time.time()
+        try:
+            resp = await openai.ChatCompletion.acreate(**backend.request_kwargs(kwargs))
+        except Exception as e:
+            self.failed(backend, e)
+            self.release(backend)
+            raise
+        if not kwargs.get("stream"):
+            self.succeeded(backend, time.time() - point)
+            self.release(backend)
+            return resp
+        return self._track_async(backend, resp, point)
+
+    async def _track_async(self, backend: Backend, stream, point: float):
+        first = True
+        try:
+            async for chunk in stream:
+                if first:
+                    self.succeeded(backend, time.time() - point)
+                    first = False
+                yield chunk
+        except Exception as e:
+            self.failed(backend, e)
+            raise
+        finally:
+            self.release(backend)
+
+    def desc(self) -> str:
+        return "\n".join(b.desc() for b in self.backends.values())
+
+
+pool = BackendPool.from_setting()
@@ -0,0 +1,140 @@
+"""
+run preset meetings without gradio, for example
+
+    python -m service.batch --rooms 辩论 并发男友 --say "开始吧" --say "继续" --copies 4 --workers 8 --out runs/nightly
+
+a script file maps room names (or "*") to the user inputs, one turn per input:
+
+    {"*": ["开始吧"], "我主持的开发会议": ["@Lily 说说需求", "@Alex 给个设计"]}
+"""
+import argparse
+import json
+import pathlib
+import statistics
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import setting
+from .holder import ChatMessage, Holder, User
+from .meeting import init_meeting
+from .preset import PresetCatalog
+
+
+def percentile(values: List[float], p: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def drive(holder: Holder, user: User, text: str, max_rounds: int) -> List[Dict]:
+    """
+    one user turn: input the text and let the holder run until it is the user's turn again.
+    after max_rounds rounds the user raises a hand, just like the 举手 button
+    """
+    holder.input(ChatMessage(user_name=user.name, supplement=user.title, content=text))
+    rounds = []
+    point = time.time()
+    first_token = None
+    for lines in holder.starts():
+        if lines:
+            if first_token is None and any(content for _, content in lines):
+                first_token = time.time() - point
+            continue
+        rounds.append(dict(speakers=[p.name for p in holder.next], first_token=first_token,
+                           duration=time.time() - point))
+        if len(rounds) >= max_rounds:
+            holder.user_raised_hand()
+        point = time.time()
+        first_token = None
+    return rounds
+
+
+def run_meeting(room: str, meeting: Dict, inputs: List[str], max_rounds: int, out: pathlib.Path) -> Dict:
+    meeting_id = f"batch-{uuid.uuid4().hex[:12]}"
+    point = time.time()
+    holder, user, _ = init_meeting(meeting, meeting_id)
+    setup = time.time() - point
+    turns, error = [], None
+    for text in inputs:
+        try:
+            turns.append(dict(input=text, rounds=drive(holder, user, text, max_rounds)))
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+            break
+    transcript = [m.dict(include={"user_name", "content", "user_invisible", "bot_invisible"})
+                  for m in holder.strategy.msg_list[0]()]
+    result = dict(room=room, meeting_id=meeting_id, setup=setup, duration=time.time() - point, error=error,
+                  turns=turns, transcript=transcript, events=holder.holder_note.dump())
+    (out / f"{meeting_id}.json").write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    return result
+
+
+def run_jobs(jobs: List[Tuple[str, Dict, List[str]]], workers: int, max_rounds: int, out: str) -> List[Dict]:
+    out = pathlib.Path(out)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_meeting, room, meeting, inputs, max_rounds, out)
+                   for room, meeting, inputs in jobs]
+        return [f.result() for f in futures]
+
+
+def summarize(results: List[Dict]) -> Dict:
+    summary = {}
+    for room in sorted({r["room"] for r in results}):
+        mine = [r for r in results if r["room"] == room]
+        rounds = [rd for r in mine for t in r["turns"] for rd in t["rounds"]]
+        durations = [rd["duration"] for rd in rounds]
+        first_tokens = [rd["first_token"] for rd in rounds if rd["first_token"] is not None]
+        summary[room] = dict(
+            meetings=len(mine), failed=sum(1 for r in mine if r["error"]), rounds=len(rounds),
+            setup_mean=statistics.mean(r["setup"] for r in mine),
+            meeting_mean=statistics.mean(r["duration"] for r in mine),
+            round_p50=percentile(durations, 50), round_p95=percentile(durations, 95),
+            first_token_p50=percentile(first_tokens, 50), first_token_p95=percentile(first_tokens, 95))
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="run preset meetings headless")
+    parser.add_argument("--preset", nargs="*", default=setting.presets, help="json or toml, later files win")
+    parser.add_argument("--rooms", nargs="*", help="rooms to run, every room of the preset by default")
+    parser.add_argument("--script", help="json file mapping a room (or '*') to its user inputs")
+    parser.add_argument("--say", action="append", default=[], help="user input for every room, repeatable")
+    parser.add_argument("--copies", type=int, default=1, help="how many times each room is run")
+    parser.add_argument("--workers", type=int, default=4, help="meetings running at once in every process")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--max-rounds", type=int, default=5, help="rounds per user input before the user hands up")
+    parser.add_argument("--out", default="./runs")
+    args = parser.parse_args(argv)
+
+    catalog = PresetCatalog(args.preset)
+    script = json.loads(pathlib.Path(args.script).read_text(encoding="utf-8")) if args.script else {}
+    rooms = args.rooms or catalog.rooms()
+    jobs = []
+    for room in rooms:
+        inputs = script.get(room) or script.get("*") or args.say or ["开始吧"]
+        jobs += [(room, catalog.source(room), inputs)] * args.copies
+
+    out = pathlib.Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    point = time.time()
+    if args.processes > 1:
+        shares = [jobs[i::args.processes] for i in range(args.processes)]
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            futures = [executor.submit(run_jobs, share, args.workers, args.max_rounds, str(out))
+                       for share in shares if share]
+            results = [r for f in futures for r in f.result()]
+    else:
+        results = run_jobs(jobs, args.workers, args.max_rounds, str(out))
+
+    summary = dict(wall=time.time() - point, rooms=summarize(results))
+    (out / "summary.json").write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+benchmarks for the meeting engine hot paths, against an in-process stub of openai, for example
+
+    python -m service.bench --save
+    python -m service.bench --compare HEAD~3 --threshold 0.15
+
+every run is saved as runs/bench/<commit>.json, --compare takes such a file or a commit and
+fails (exit code 1) when a case got slower than the threshold
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import pathlib
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import openai
+
+from .holder import AIHolder, Bot, ChatMessage, ChatMessageList, Holder, RoundRobin, User
+from .mock_server import MockConfig, MockLLM
+from .ratelimit import RateLimiter, retry
+from .render import ChatRenderer
+
+REPLY = "好的,我来说两句.这个问题我们可以先拆成几个小的部分,再一个一个的解决. " \
+        "first we agree on the goal, then everyone takes one part of it and reports back tomorrow."
+
+
+class StubOpenAI:
+    """
+    answers ChatCompletion.create / acreate right away with the mock server's replies, so a benchmark
+    measures our code and not the network. the async stream yields to the loop between tokens
+    """
+
+    def __init__(self):
+        self.llm = MockLLM(MockConfig(replies=[REPLY]))
+        self.saved = None
+
+    def chunks(self, kwargs):
+        yield dict(choices=[dict(index=0, delta=dict(role="assistant"), finish_reason=None)])
+        for delta in self.llm.deltas(kwargs["messages"]):
+            yield dict(choices=[dict(index=0, delta=dict(content=delta), finish_reason=None)])
+        yield dict(choices=[dict(index=0, delta={}, finish_reason="stop")])
+
+    def create(self, **kwargs):
+        if kwargs.get("stream"):
+            return self.chunks(kwargs)
+        content = "".join(self.llm.deltas(kwargs["messages"]))
+        return dict(choices=[dict(index=0, message=dict(role="assistant", content=content), finish_reason="stop")])
+
+    async def acreate(self, **kwargs):
+        if not kwargs.get("stream"):
+            return self.create(**kwargs)
+
+        async def stream():
+            for chunk in self.chunks(kwargs):
+                await asyncio.sleep(0)
+                yield chunk
+
+        return stream()
+
+    def __enter__(self):
+        self.saved = openai.ChatCompletion.create, openai.ChatCompletion.acreate, retry.limiter
+        openai.ChatCompletion.create, openai.ChatCompletion.acreate = self.create, self.acreate
+        # the process wide limits would throttle the benchmark, not openai
+        retry.limiter = RateLimiter()
+        return self
+
+    def __exit__(self, *exc):
+        openai.ChatCompletion.create, openai.ChatCompletion.acreate, retry.limiter = self.saved
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def measure(run: Callable[[], object], repeat: int, warmup: int = 2, setup: Callable[[], object] | None = None,
+            units: bool = False) -> Dict:
+    """
+    time repeat calls of run (setup is called before each one and not timed), then one more
+    pass under tracemalloc for the memory numbers. with units run returns how much work it did (tokens, frames)
+    """
+    for _ in range(warmup):
+        setup and setup()
+        run()
+    samples, done = [], 0
+    for _ in range(repeat):
+        setup and setup()
+        point = time.perf_counter()
+        result = run()
+        samples.append(time.perf_counter() - point)
+        done += result if units else 1
+
+    setup and setup()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    blocks = sys.getallocatedblocks()
+    run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return dict(repeat=repeat, p50=percentile(samples, 50), p95=percentile(samples, 95),
+                p99=percentile(samples, 99), mean=sum(samples) / len(samples),
+                per_unit=sum(samples) / done if units else None,
+                peak_kb=(peak - base) / 1024, retained_kb=(current - base) / 1024,
+                blocks=sys.getallocatedblocks() - blocks)
+
+
+def history(n: int, names: List[str]) -> List[ChatMessage]:
+    rnd = random.Random(n)
+    return [ChatMessage(user_name=rnd.choice(names), supplement="", content=f"{i}: {REPLY}",
+                        bot_invisible=i % 17 == 0, user_invisible=i % 23 == 0) for i in range(n)]
+
+
+def bots(n: int, msg_list) -> List[Bot]:
+    return [Bot(name=f"bot{i}", title="engineer", prompt=f"you are bot{i}, an engineer", msg_list=msg_list)
+            for i in range(n)]
+
+
+def bench_parallel(sizes: List[int], repeat: int) -> Dict:
+    """
+    one Holder.parallel round, every participant streaming the whole reply
+    """
+    results = {}
+    for n in sizes:
+        msg_list = ChatMessageList()
+        participants = bots(n, msg_list)
+        for m in history(20, [p.name for p in participants]):
+            msg_list[1](m)
+        holder = Holder.new_meeting(RoundRobin(sequence=[p.name for p in participants], msg_list=msg_list), "bench")
+        holder.next = participants
+
+        def run():
+            tokens = 0
+            for _ in holder.parallel():
+                tokens += 1
+            return tokens
+
+        results[f"parallel/{n}"] = measure(run, repeat, units=True)
+    return results
+
+
+def bench_view(sizes: List[int], repeat: int) -> Dict:
+    """
+    Bot.view and User.view over a long history, cold (nothing cached) and after one new message
+    """
+    results = {}
+    for n in sizes:
+        msg_list = ChatMessageList()
+        bot, = bots(1, msg_list)
+        user = User(name="Rick", title="boss", prompt="", msg_list=msg_list)
+        for m in history(n, [bot.name, user.name, "Emma", "Liam"]):
+            msg_list[1](m)
+
+        for name, p in (("bot", bot), ("user", user)):
+            def cold(p=p):
+                p._view_cache.reset(None, 0)
+
+            def warm(p=p):
+                p.view()
+                msg_list[1](ChatMessage(user_name="Emma", supplement="", content=REPLY))
+
+            results[f"view/{name}/{n}/cold"] = measure(p.view, repeat, setup=cold)
+            results[f"view/{name}/{n}/warm"] = measure(p.view, repeat, setup=warm)
+    return results
+
+
+def bench_ai_holder(participants: int, repeat: int) -> Dict:
+    """
+    one AIHolder.next decision, with a hundred messages of history
+    """
+    msg_list = ChatMessageList()
+    holder_bot = Bot(name="Rick", title="host", prompt="you are holding the meeting", msg_list=msg_list,
+                     instruction='answer in json: {"next":"<participant>","reason":"<why>","question":"<ask>"}')
+    ai_holder = AIHolder(msg_list=msg_list, holder=holder_bot,
+                         choice_prompt="pick one of [/PARTICIPANTS/] to answer next")
+    for p in bots(participants, msg_list):
+        ai_holder.participants[p.name] = p
+    for m in history(100, list(ai_holder.participants)):
+        msg_list[1](m)
+    return {f"ai_holder_next/{participants}": measure(ai_holder.next, repeat)}
+
+
+def bench_render(participants: int, window: int, repeat: int) -> Dict:
+    """
+    what on_chatbot_answer does per token: one ChatRenderer.frame over the growing word lines
+    """
+    msg_list = ChatMessageList()
+    user = User(name="Rick", title="boss", prompt="", msg_list=msg_list)
+    for m in history(5000, ["Rick", "Emma", "Liam"]):
+        msg_list[1](m)
+    renderer = ChatRenderer(user, window)
+    renderer.frame()
+    deltas = MockLLM(MockConfig(replies=[REPLY])).deltas([])
+    frames, word_lines = [], [(f"bot{i}", "") for i in range(participants)]
+    for delta in deltas:
+        for i in range(participants):
+            word_lines[i] = (word_lines[i][0], word_lines[i][1] + delta)
+            frames.append(list(word_lines))
+
+    def run():
+        for lines in frames:
+            renderer.frame(lines)
+        return len(frames)
+
+    return {f"render/{participants}x{window}": measure(run, repeat, units=True)}
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_baseline(ref: str, out: pathlib.Path) -> Dict:
+    path = pathlib.Path(ref)
+    if not path.is_file():
+        sha = subprocess.run(["git", "rev-parse", "--short", ref], capture_output=True, text=True).stdout.strip()
+        path = out / f"{sha or ref}.json"
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> List[str]:
+    """
+    print p50 / p95 / peak memory changes per case, return the cases slower than the threshold
+    """
+    regressions = []
+    print(f"\n{'case':<32}{'p50':>12}{'p95':>12}{'peak kb':>12}   vs {baseline['commit']}")
+    for case, now in current["cases"].items():
+        before = baseline["cases"].get(case)
+        if before is None:
+            print(f"{case:<32}{'new':>12}")
+            continue
+        changes = [now[k] / before[k] - 1 if before[k] else 0 for k in ("p50", "p95", "peak_kb")]
+        print(f"{case:<32}" + "".join(f"{c:>+12.1%}" for c in changes))
+        if changes[0] > threshold:
+            regressions.append(case)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the meeting engine against a stubbed llm")
+    parser.add_argument("--only", nargs="*", choices=["parallel", "view", "ai_holder", "render"])
+    parser.add_argument("--participants", nargs="*", type=int, default=[1, 5, 10, 25, 50])
+    parser.add_argument("--history", nargs="*", type=int, default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="./runs/bench")
+    parser.add_argument("--save", action="store_true", help="save this run as the baseline of the commit")
+    parser.add_argument("--compare", help="a saved run or a commit to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="p50 slow down counted as a regression")
+    args = parser.parse_args(argv)
+
+    only = args.only or ["parallel", "view", "ai_holder", "render"]
+    random.seed(args.seed)
+    cases = {}
+    # the engine prints its decisions, keep them out of the report
+    with StubOpenAI(), contextlib.redirect_stdout(io.StringIO()):
+        if "parallel" in only:
+            cases.update(bench_parallel(args.participants, args.repeat))
+        if "view" in only:
+            cases.update(bench_view(args.history, args.repeat))
+        if "ai_holder" in only:
+            cases.update(bench_ai_holder(max(args.participants), args.repeat))
+        if "render" in only:
+            cases.update(bench_render(4, 200, args.repeat))
+
+    result = dict(commit=commit(), python=sys.version.split()[0], created=time.time(), cases=cases)
+    print(f"{'case':<32}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'per unit us':>14}{'peak kb':>10}{'blocks':>9}")
+    for case, r in cases.items():
+        per_unit = f"{r['per_unit'] * 1e6:>14.1f}" if r["per_unit"] is not None else f"{'':>14}"
+        print(f"{case:<32}{r['p50'] * 1e3:>10.3f}{r['p95'] * 1e3:>10.3f}{r['p99'] * 1e3:>10.3f}{per_unit}"
+              f"{r['peak_kb']:>10.1f}{r['blocks']:>9}")
+
+    out = pathlib.Path(args.out)
+    if args.save:
+        out.mkdir(parents=True, exist_ok=True)
+        (out / f"{result['commit']}.json").write_text(json.dumps(result, indent=2), encoding="utf-8")
+    if args.compare:
+        regressions = compare(load_baseline(args.compare, out), result, args.threshold)
+        if regressions:
+            print(f"\nslower than {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import pathlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List
+
+
+class ResponseCache:
+    """
+    content addressed cache of chat completions, keyed on the normalized request params.
+
+    entries live in an in-memory LRU and, when disk_dir is set, in one json file per key.
+    a streamed response is kept as its list of chunks so it can be replayed chunk by chunk.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float | None = 24 * 3600, disk_dir: str | None = None,
+                 max_disk_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = pathlib.Path(disk_dir) if disk_dir else None
+        self.max_disk_bytes = max_disk_bytes
+        self.memory: OrderedDict[str, Dict] = OrderedDict()
+        self.lock = threading.Lock()
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(params: Dict) -> str:
+        # "user" only tags the caller for openai, it never changes the answer
+        normalized = {k: v for k, v in params.items() if k != "user" and v is not None}
+        raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _expired(self, entry: Dict) -> bool:
+        return self.ttl is not None and time.time() - entry["created"] > self.ttl
+
+    def get(self, key: str) -> Dict | None:
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if not self._expired(entry):
+                    self.memory.move_to_end(key)
+                    return entry
+                del self.memory[key]
+        entry = self._read_disk(key)
+        if entry is None:
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, entry: Dict):
+        entry = dict(entry, created=time.time())
+        self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def put_response(self, key: str, response):
+        self.put(key, {"stream": False, "response": json.loads(json.dumps(response))})
+
+    def put_chunks(self, key: str, chunks: List):
+        self.put(key, {"stream": True, "chunks": json.loads(json.dumps(chunks))})
+
+    def _remember(self, key: str, entry: Dict):
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.disk_dir / f"{key}.json"
+
+    def _read_disk(self, key: str) -> Dict | None:
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if self._expired(entry):
+            path.unlink(missing_ok=True)
+            return None
+        return entry
+
+    def _write_disk(self, key: str, entry: Dict):
+        if not self.disk_dir:
+            return
+        tmp = self._path(key).with_suffix(".tmp")
+        tmp.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self._path(key))
+        self._evict_disk()
+
+    def _evict_disk(self):
+        files = [(p, p.stat()) for p in self.disk_dir.glob("*.json")]
+        total = sum(st.st_size for _, st in files)
+        if total <= self.max_disk_bytes:
+            return
+        for p, st in sorted(files, key=lambda x: x[1].st_mtime):
+            p.unlink(missing_ok=True)
+            total -= st.st_size
+            if total <= self.max_disk_bytes:
+                break
+
+    def record(self, key: str, stream: Iterator) -> Iterator:
+        """
+        pass a live stream through, it is stored only if it was read to the end
+        """
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        self.put_chunks(key, chunks)
+
+    async def record_async(self, key: str, stream):
+        chunks = []
+        async for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        self.put_chunks(key, chunks)
+
+
+def replay(entry: Dict) -> Iterator:
+    yield from entry["chunks"]
+
+
+async def replay_async(entry: Dict):
+    for chunk in entry["chunks"]:
+        yield chunk
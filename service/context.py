@@ -0,0 +1,50 @@
+from typing import Dict, List
+
+from .tokens import count_tokens, TOKENS_PER_MESSAGE, TOKENS_PER_REPLY
+
+
+def count_message_tokens(msg: Dict, model: str = "gpt-3.5-turbo") -> int:
+    return TOKENS_PER_MESSAGE + count_tokens(msg["content"], model)
+
+
+def omitted_note(n: int) -> Dict:
+    return dict(role="user", content=f"(... {n} earlier messages are omitted ...)")
+
+
+def fit_context(messages: List[Dict], budget: int | None, reserve: int = 0,
+                model: str = "gpt-3.5-turbo", pinned: int = 1) -> List[Dict]:
+    """
+    keep the system prompt (the first message) and as many of the latest turns as fit in budget tokens,
+    older turns are dropped and replaced by a short note. if even the latest turn does not fit, its head is cut.
+    reserve is what the caller is going to append afterwards, an instruction for example.
+    the first pinned messages are always kept, the system prompt and the minutes of a long meeting
+    """
+    if not budget or len(messages) <= pinned:
+        return messages
+    system, turns = messages[:pinned], messages[pinned:]
+    left = budget - reserve - TOKENS_PER_REPLY - sum(count_message_tokens(m, model) for m in system)
+
+    kept = []
+    for msg in reversed(turns):
+        cost = count_message_tokens(msg, model)
+        if cost > left:
+            break
+        kept.append(msg)
+        left -= cost
+
+    dropped = len(turns) - len(kept)
+    if not dropped:
+        return messages
+    if not kept:
+        latest = turns[-1]
+        room = max(left - TOKENS_PER_MESSAGE, 0)
+        content = latest["content"]
+        # shrink from the head until it fits, the end of a message is what the bot answers to
+        while content and count_tokens(content, model) > room:
+            content = content[len(content) // 8 + 1:]
+        return system + [dict(role=latest["role"], content=content)]
+
+    note = omitted_note(dropped)
+    if count_message_tokens(note, model) > left:
+        return system + kept[::-1]
+    return system + [note] + kept[::-1]
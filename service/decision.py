@@ -0,0 +1,175 @@
+import json
+from typing import Dict, List
+
+# the separators models put between a key and its value, the full width ones included
+SEPARATORS = ":;=：；"
+OPENERS = "\"'“”"
+COMMAS = ",，"
+
+SEEK_OBJECT, SEEK_KEY, IN_KEY, SEEK_SEPARATOR, SEEK_VALUE, IN_STRING, CLOSING, AFTER_COMMA, IN_BARE, DONE = range(10)
+
+
+def _decode(raw: str) -> str:
+    try:
+        return json.loads(f'"{raw}"', strict=False)
+    except ValueError:
+        return raw.replace('\\"', '"').replace("\\n", "\n")
+
+
+class DecisionStream:
+    """
+    incremental, forgiving parser for the holder's one level json decision like
+    {"next":"<participant>","reason":"<some reasons>","question":"<question>"}
+
+    feed it the streamed text, every field is available as soon as its value is closed.
+    it tolerates code fences, text around the object, single or curly quotes, ';' instead of ':',
+    unescaped quotes inside a value and a reply that is cut off before the end
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.text: List[str] = []
+        self.state = SEEK_OBJECT
+        self.depth = 0
+        self.quote = '"'
+        self.escape = False
+        self.key: List[str] = []
+        self.value: List[str] = []
+        self.pending: List[str] = []
+
+    @property
+    def done(self):
+        return self.state == DONE
+
+    def has(self, *keys: str) -> bool:
+        return all(k in self.fields for k in keys)
+
+    def feed(self, chunk: str) -> List[str]:
+        """
+        returns the keys completed by this chunk
+        """
+        self.text.append(chunk)
+        completed = []
+        for c in chunk:
+            key = self._step(c)
+            if key is not None:
+                completed.append(key)
+        return completed
+
+    def finish(self) -> List[str]:
+        """
+        the stream has ended, close whatever value is still open
+        """
+        completed = []
+        if self.state in (IN_STRING, CLOSING, AFTER_COMMA, IN_BARE) and self.key:
+            completed.append(self._close(self.state != IN_BARE))
+        self.state = DONE
+        return completed
+
+    def _close(self, quoted: bool) -> str:
+        key = "".join(self.key).strip()
+        raw = "".join(self.value)
+        self.fields[key] = _decode(raw) if quoted else raw.strip()
+        self.key, self.value = [], []
+        return key
+
+    @staticmethod
+    def _closes(opener: str, c: str) -> bool:
+        return c == opener or (opener in "“”" and c in "“”")
+
+    def _step(self, c: str) -> str | None:
+        state = self.state
+        if state == SEEK_OBJECT:
+            if c == "{":
+                self.state = SEEK_KEY
+        elif state == SEEK_KEY:
+            if c in OPENERS:
+                self.quote, self.state = c, IN_KEY
+            elif c == "}":
+                self.state = DONE
+        elif state == IN_KEY:
+            if self._closes(self.quote, c):
+                self.state = SEEK_SEPARATOR
+            else:
+                self.key.append(c)
+        elif state == SEEK_SEPARATOR:
+            if c in SEPARATORS:
+                self.state = SEEK_VALUE
+        elif state == SEEK_VALUE:
+            if c in OPENERS:
+                self.quote, self.state, self.escape = c, IN_STRING, False
+            elif not c.isspace():
+                self.depth = 1 if c in "{[" else 0
+                self.value.append(c)
+                self.state = IN_BARE
+        elif state == IN_STRING:
+            if self.escape:
+                self.escape = False
+                self.value.append(c)
+            elif c == "\\":
+                self.escape = True
+                self.value.append(c)
+            elif self._closes(self.quote, c):
+                # only a quote followed by '}', or by ',' and the next key, ends the value
+                self.state = CLOSING
+            else:
+                self.value.append(c)
+        elif state == CLOSING:
+            if c.isspace():
+                self.pending.append(c)
+                return None
+            if c == "}":
+                self.pending = []
+                self.state = DONE
+                return self._close(True)
+            if c in COMMAS:
+                self.pending.append(c)
+                self.state = AFTER_COMMA
+                return None
+            return self._literal(c)
+        elif state == AFTER_COMMA:
+            if c.isspace():
+                self.pending.append(c)
+                return None
+            if c in OPENERS or c == "}":
+                # 'he said "yes", fine' goes on, '"yes", "reason"' starts the next key
+                self.pending = []
+                key = self._close(True)
+                self.quote, self.state = c, IN_KEY if c != "}" else DONE
+                return key
+            return self._literal(c)
+        elif state == IN_BARE:
+            if c in "{[":
+                self.depth += 1
+            elif c in "}]" and self.depth:
+                self.depth -= 1
+            elif self.depth == 0 and (c in COMMAS or c in "}\n"):
+                key = self._close(False)
+                self.state = DONE if c == "}" else SEEK_KEY
+                return key
+            self.value.append(c)
+        return None
+
+    def _literal(self, c: str) -> str | None:
+        # the quote (and what followed it) was part of the value after all
+        self.value.append('\\"' if self.quote == '"' else self.quote)
+        self.value.extend(self.pending)
+        self.pending = []
+        self.state = IN_STRING
+        return self._step(c)
+
+
+def parse_decision(text: str) -> Dict[str, str]:
+    """
+    parse a complete reply, strict json first then the forgiving parser
+    """
+    try:
+        loads = json.loads(text)
+        if isinstance(loads, dict):
+            return {k: v if isinstance(v, str) else json.dumps(v, ensure_ascii=False) for k, v in loads.items()}
+    except ValueError:
+        pass
+    decision = DecisionStream()
+    decision.feed(text)
+    decision.finish()
+    return decision.fields
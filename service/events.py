@@ -0,0 +1,66 @@
+import itertools
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Tuple
+
+# where llm events of the current meeting go, Holder sets it around its calls
+event_sink: ContextVar[Callable[[str, str], None] | None] = ContextVar("event_sink", default=None)
+
+
+def emit(event: str, result: str):
+    sink = event_sink.get()
+    if sink is not None:
+        sink(event, result)
+
+
+class EventLog:
+    """
+    the latest maxlen events of a meeting, numbered from 1. a reader keeps the seq of the last event
+    it has seen and asks for the ones after it, older events fall off the front
+    """
+
+    def __init__(self, maxlen: int = 500):
+        self.events: deque[Dict] = deque(maxlen=maxlen)
+        # of the last event, 0 before the first one
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def append(self, event: str, result: str) -> int:
+        with self.lock:
+            self.seq += 1
+            self.events.append(dict(seq=self.seq, time=time.time(), event=event, result=result))
+            return self.seq
+
+    def since(self, cursor: int) -> Tuple[List[Dict], int, int]:
+        """
+        the events after cursor, the cursor to ask with next time, and how many events after
+        cursor were dropped before they could be read
+        """
+        with self.lock:
+            if cursor >= self.seq:
+                return [], self.seq, 0
+            first = self.events[0]["seq"] if self.events else self.seq + 1
+            start = max(cursor + 1 - first, 0)
+            return list(itertools.islice(self.events, start, None)), self.seq, max(first - cursor - 1, 0)
+
+    def dump(self) -> List[Dict]:
+        with self.lock:
+            return list(self.events)
+
+    def load(self, events: List[Dict]):
+        """
+        events dumped before, a meeting spilled by an older version has them without seq
+        """
+        with self.lock:
+            self.events.clear()
+            for e in events:
+                self.seq = e.get("seq", self.seq + 1)
+                self.events.append(dict(e, seq=self.seq))
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.dump())
+
+    def __len__(self):
+        return len(self.events)
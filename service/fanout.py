@@ -0,0 +1,106 @@
+import asyncio
+import contextvars
+import queue
+import threading
+from typing import AsyncIterator, Iterator, List, Tuple
+
+_DELTA, _ERROR, _DONE, _CANCEL = range(4)
+
+
+class FanOut:
+    """
+    drive every async stream at the same time on a private event loop,
+    iterating yields (index of stream, delta) in the order the deltas arrive.
+    with tick a None is yielded whenever no delta came in for tick seconds.
+
+    the loop runs inside context (a copy of the caller's by default).
+    cancel() may be called from any thread, before the iteration starts too: the streams are cancelled right away, which closes
+    them (and the http responses under them) on the loop, and the iteration stops.
+    closing the iterator cancels whatever is still streaming too.
+    """
+
+    def __init__(self, streams: List[AsyncIterator[str]], context: contextvars.Context | None = None,
+                 tick: float | None = None):
+        self.streams = streams
+        self.context = context
+        self.tick = tick
+        self.cancelled = False
+        self.finished = [False] * len(streams)
+        self.q = queue.SimpleQueue()
+        self.loop = None
+        self.task = None
+
+    def cancel(self):
+        self.cancelled = True
+        self._stop()
+        # wake the reader up if it is waiting for the next delta
+        self.q.put((None, _CANCEL, None))
+
+    def _stop(self):
+        if self.task is None or self.task.done():
+            return
+        try:
+            self.loop.call_soon_threadsafe(self.task.cancel)
+        except RuntimeError:
+            # loop already closed, nothing left to cancel
+            pass
+
+    def __iter__(self) -> Iterator[Tuple[int, str] | None]:
+        if self.cancelled:
+            # cancelled before it started, no stream is ever opened
+            return
+        q = self.q
+        loop = self.loop = asyncio.new_event_loop()
+
+        async def pump(i, stream):
+            try:
+                async for delta in stream:
+                    q.put((i, _DELTA, delta))
+            except Exception as e:
+                q.put((i, _ERROR, e))
+            else:
+                # a cancelled stream never gets here, it is not finished
+                q.put((i, _DONE, None))
+
+        async def gather():
+            await asyncio.gather(*(pump(i, s) for i, s in enumerate(self.streams)))
+
+        # tasks copy the context they are created in
+        self.task = (self.context or contextvars.copy_context()).run(loop.create_task, gather())
+
+        def run():
+            try:
+                loop.run_until_complete(self.task)
+            except asyncio.CancelledError:
+                pass
+            finally:
+                loop.run_until_complete(loop.shutdown_asyncgens())
+                loop.close()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+
+        pending = len(self.streams)
+        try:
+            while pending and not self.cancelled:
+                try:
+                    i, kind, payload = q.get(timeout=self.tick)
+                except queue.Empty:
+                    yield None
+                    continue
+                if kind == _DONE:
+                    self.finished[i] = True
+                    pending -= 1
+                elif kind == _ERROR:
+                    raise payload
+                elif kind == _DELTA:
+                    yield i, payload
+        finally:
+            self._stop()
+            # the streams are closed once the loop is done with them
+            thread.join()
+
+
+def fan_out(streams: List[AsyncIterator[str]], context: contextvars.Context | None = None,
+            tick: float | None = None) -> Iterator[Tuple[int, str] | None]:
+    return iter(FanOut(streams, context, tick))
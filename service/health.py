@@ -0,0 +1,68 @@
+import threading
+import time
+
+import openai
+
+import setting
+from .backend import pool, Backend
+from .llm import ChatParams
+
+
+class HealthChecker:
+    """
+    probes every llm backend in the background and keeps the last result for every session to read.
+    the probe only looks the model up, it costs no tokens. results also eject or bring back backends in the pool
+    """
+
+    def __init__(self, interval: float = 60):
+        self.interval = interval
+        self.ok: bool | None = None
+        self.detail = "checking connection to openai"
+        self.latency = 0.0
+        self.checked_at = 0.0
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def probe(self, backend: Backend):
+        openai.Model.retrieve(backend.model or ChatParams.__fields__["model"].default, api_key=backend.api_key,
+                              api_base=backend.api_base)
+
+    def check(self):
+        point = time.time()
+        down = []
+        for backend in pool.backends.values():
+            try:
+                self.probe(backend)
+            except Exception as e:
+                pool.failed(backend, e)
+                down.append(f"{backend.name} ({e})")
+            else:
+                pool.succeeded(backend)
+        if not down:
+            self.ok, self.detail = True, "connected to openai"
+        elif len(down) == len(pool.backends):
+            self.ok, self.detail = False, f"openai unreachable: {', '.join(down)}"
+        else:
+            self.ok, self.detail = True, f"connected to openai, backends down: {', '.join(down)}"
+        self.latency = time.time() - point
+        self.checked_at = time.time()
+
+    def _run(self):
+        while True:
+            self.check()
+            time.sleep(self.interval)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="llm-health")
+                self._thread.start()
+        return self
+
+    def status(self) -> str:
+        if not self.checked_at:
+            return self.detail
+        return f"{self.detail} ({self.latency * 1000:.0f}ms, checked {time.time() - self.checked_at:.0f}s ago)"
+
+
+health = HealthChecker(setting.health_check_interval)
@@ -1,12 +1,23 @@
-import json
+import contextvars
 import random
 import re
 import time
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Callable
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
-from .llm import get_whole_response, Message, get_char_stream, get_stream_from_openai
+import setting
+from .context import fit_context
+from .decision import DecisionStream, parse_decision
+from .events import EventLog, event_sink, emit
+from .fanout import FanOut
+from .llm import get_whole_response, get_char_stream, get_stream_from_openai, stream_response_async
+from .log import MessageLog, MessageRecord, ViewCache
+from .metrics import Metrics, meeting_metrics, registry
+from .scheduler import NORMAL, WAITING, meeting_scope, scheduled, slot
+from .store import SegmentLog
+from .summary import rolling_summary, summary_message
+from .tokens import count_tokens
 
 
 class ChatMessage(BaseModel):
@@ -16,28 +27,22 @@ class ChatMessage(BaseModel):
     user_invisible: bool = False
     bot_invisible: bool = False
 
+    # logs holding this message, told when a visibility flag flips after the push
+    _touch: List[Callable] = PrivateAttr(default_factory=list)
 
-def ChatMessageList():
-    msg_list: List[ChatMessage] = []
+    def __setattr__(self, key, value):
+        flipped = key in ("user_invisible", "bot_invisible") and getattr(self, key) != value
+        super().__setattr__(key, value)
+        if flipped:
+            for touch in self._touch:
+                touch(key, value)
 
-    def push_message(msg: ChatMessage):
-        msg_list.append(msg)
 
-    def copy(x):
-        return x
-
-    def get_msg_list(map_=copy, index=None):
-        if index is not None:
-            return msg_list[index]
-        result = []
-        for m in msg_list:
-            r = map_(m)
-            if r is None:
-                continue
-            result.append(r)
-        return result
-
-    return get_msg_list, push_message
+def ChatMessageList(store: SegmentLog | None = None, resident: int = 500):
+    """
+    a MessageLog behind the (get_msg_list, push_message, size, log) tuple the strategies share
+    """
+    return MessageLog(store, resident).functions()
 
 
 class Participant(BaseModel):
@@ -46,15 +51,28 @@ class Participant(BaseModel):
     prompt: str | None
     msg_list: Tuple | None
 
+    _view_cache: ViewCache = PrivateAttr(default_factory=ViewCache)
+
     class Config:
         copy_on_model_validation = 'none'
 
-    def view(self) -> List[ChatMessage | Message]:
+    def clone(self):
+        """
+        a copy that is not validated again, with caches of its own
+        """
+        p = self.copy()
+        p._init_private_attributes()
+        return p
+
+    def view(self) -> List:
         pass
 
     def answer(self):
         raise NotImplementedError
 
+    def answer_async(self):
+        raise NotImplementedError
+
     def desc(self):
         return ""
 
@@ -73,44 +91,53 @@ class UserTurnInterrupt(MeetingError):
 
 class Bot(Participant):
     instruction: str = ""
+    context_budget: int | None = None
+    # pin this bot to a backend from setting.backends and/or to a model
+    backend: str | None = None
+    model: str | None = None
 
-    def view_(self):
-        result = []
-        temp = []
-        msg_list = self.msg_list[0]()
-        for i, msg in enumerate(msg_list[::-1]):
-            if msg.user_name == self.name:
-                if temp:
-                    compress = "\n\n".join([f"{m.user_name}: ({m.content})" for m in temp[::-1]])
-                    result.append(Message(role="user", content=compress))
-                    temp = []
-                result.append(Message(role="assistant", content=msg.content))
-                continue
-            temp.append(msg)
-        else:
-            if temp:
-                compress = "\n\n".join([f"{m.user_name}: ({m.content})" for m in temp[::-1]])
-                result.append(Message(role="user", content=compress))
-        result.append(Message(role="system", content=self.prompt))
-        return result[::-1]
+    _system: Dict | None = PrivateAttr(default=None)
 
-    def map_(self, msg: ChatMessage):
+    def map_(self, msg: MessageRecord):
+        # already in the shape openai takes, a request only copies the list
         if msg.bot_invisible:
             return None
         if msg.user_name == self.name:
-            return Message(role="assistant", content=msg.content)
-        return Message(role="user", content=f"{msg.user_name}: {msg.content}")
-
-    def view(self):
-        result = self.msg_list[0](self.map_)
-        result.insert(0, Message(role="system", content=self.prompt))
-        return result
+            return dict(role="assistant", content=msg.content)
+        return dict(role="user", content=f"{msg.user_name}: {msg.content}")
+
+    def system_message(self) -> Dict:
+        if self._system is None or self._system["content"] is not self.prompt:
+            self._system = dict(role="system", content=self.prompt)
+        return self._system
+
+    def view(self, reserve: int = 0) -> List[Dict]:
+        pinned = 1
+        # position must be read from the same items the view was mapped into
+        with self._view_cache.lock:
+            result = self.msg_list[0](self.map_, cache=self._view_cache)
+            if (summary := rolling_summary(self.msg_list[3])) is not None and (latest := summary.get()) is not None:
+                # the minutes stand in for everything up to the end of the range they cover, and are kept
+                # next to the system prompt when the budget drops older turns
+                start, end, minutes = latest
+                result = [summary_message(start, end, minutes)] + result[self._view_cache.position(end):]
+                pinned = 2
+        result.insert(0, self.system_message())
+        budget = self.context_budget if self.context_budget is not None else setting.context_token_budget
+        return fit_context(result, budget, reserve=reserve + count_tokens(self.instruction), pinned=pinned)
+
+    def reorganize(self):
+        reorganize = self.view()
+        # the mapped messages are cached, never edit them in place
+        last = reorganize[-1]
+        reorganize[-1] = dict(role=last["role"], content=last["content"] + "\n\n" + self.instruction)
+        return reorganize
 
     def answer(self):
-        reorganize = self.view()
-        content = reorganize[-1].content + "\n\n" + self.instruction
-        reorganize[-1].content = content
-        return get_char_stream(get_stream_from_openai(reorganize))
+        return get_char_stream(get_stream_from_openai(self.reorganize(), self.model, self.backend))
+
+    def answer_async(self):
+        return stream_response_async(self.reorganize(), self.model, self.backend)
 
     def desc(self):
         return f"{self.name} is answering"
@@ -121,10 +148,18 @@ class User(Participant):
     def answer(self):
         raise UserTurnInterrupt
 
+    def answer_async(self):
+        raise UserTurnInterrupt
+
+    def map_(self, msg: MessageRecord):
+        if msg.user_invisible:
+            return None
+        if msg.user_name == self.name:
+            return msg.content, None
+        return None, f"{msg.user_name}: {msg.content}"
+
     def view(self):
-        return self.msg_list[0](
-            lambda x: None if x.user_invisible else (x.content, None) if x.user_name == self.name else (
-                None, f"{x.user_name}: {x.content}"))
+        return self.msg_list[0](self.map_, cache=self._view_cache)
 
     def desc(self):
         return "waiting for user input"
@@ -139,6 +174,9 @@ class Strategy(BaseModel):
     participants: Dict[str, Participant] = {}
     msg_list: Tuple
 
+    # the decision streaming right now, Holder.user_cancel aborts it
+    _streaming: FanOut | None = PrivateAttr(default=None)
+
     def next(self, *args, **kwargs) -> List[Tuple[Participant, str]]:
         raise NotImplementedError
 
@@ -171,35 +209,83 @@ class AIHolder(Strategy):
         - /PARTICIPANTS/ : all participant names in comma separated
     """
 
-    def reorganize(self) -> List[Message]:
-        return self.holder.view()
+    def reorganize(self, reserve: int = 0) -> List[Dict]:
+        return self.holder.view(reserve=reserve)
 
     def next(self) -> List[Tuple[Participant, str]]:
-        reorganized_msgs = self.reorganize()
-
-        content = reorganized_msgs[-1].content
-
         PARTICIPANTS = ",".join(self.participants)
 
         q = self.choice_prompt.replace("/PARTICIPANTS/", PARTICIPANTS)
-        reorganized_msgs[-1].content = content + "\n\n" + q + "\n\n" + self.holder.instruction
-        response = get_whole_response(reorganized_msgs)
-        print("decision: ", response)
-        # some retry things
-        try:
-            loads = json.loads(response)
-            name, reason, question = loads["next"], loads["reason"], loads["question"]
+        reorganized_msgs = self.reorganize(reserve=count_tokens(q))
+
+        last = reorganized_msgs[-1]
+        reorganized_msgs[-1] = dict(role=last["role"],
+                                    content=last["content"] + "\n\n" + q + "\n\n" + self.holder.instruction)
+        decision = self.stream_decision(reorganized_msgs)
+        print("decision: ", "".join(decision.text))
+        participant = self.find_participant(decision.fields.get("next"))
 
-        except json.JSONDecodeError:
+        if participant is None or not decision.has("question"):
             emphasis = '"所有的回答请写在下面的json格式里,就像这样:\n-----\n{\"next\":\"玛丽\",\"reason\":\"我觉得他会推进我们现在的进度\",\"question\":\"请问玛丽,你觉得我们该如何做才能完成既定的目标?\"}"'
-            reorganized_msgs[-1].content += emphasis
-            response = get_whole_response(reorganized_msgs)
+            last = reorganized_msgs[-1]
+            reorganized_msgs[-1] = dict(role=last["role"], content=last["content"] + emphasis)
+            with slot(WAITING):
+                response = get_whole_response(reorganized_msgs, self.holder.model, self.holder.backend)
             print("llm escaped the answer format,got retry. ", response)
-            loads = json.loads(response)
-            name, reason, question = loads["next"], loads["reason"], loads["question"]
-
-        self.solid(self.participants[name], reason, question)
-        return [(self.participants[name], reason)]
+            loads = parse_decision(response)
+            # whatever the retry left out is taken from the first try
+            participant = self.find_participant(loads.get("next")) or participant
+            decision.fields = dict(decision.fields, **loads)
+            if participant is None or not decision.has("question"):
+                raise ValueError(f"{self.holder.name} did not say who is next and what to ask: {response[:200]}")
+
+        reason, question = decision.fields.get("reason", ""), decision.fields["question"]
+        self.solid(participant, reason, question)
+        return [(participant, reason)]
+
+    def stream_decision(self, msgs: List[Dict]) -> DecisionStream:
+        """
+        read the decision as it streams, the next speaker is known (and warmed up) before
+        reason and question are finished, and the stream is dropped once the question is closed
+        """
+        decision = DecisionStream()
+        # up before the slot is waited for, a cancel from now on never opens the stream
+        fan = self._streaming = FanOut([stream_response_async(msgs, self.holder.model, self.holder.backend)])
+        try:
+            # nothing else in the meeting moves until the holder has decided
+            with slot(WAITING):
+                self._read_decision(decision, fan)
+        finally:
+            self._streaming = None
+        if fan.cancelled:
+            raise UserCancel
+        decision.finish()
+        return decision
+
+    def _read_decision(self, decision: DecisionStream, fan: FanOut):
+        deltas = iter(fan)
+        try:
+            for _, chunk in deltas:
+                for key in decision.feed(chunk):
+                    if key == "next" and (p := self.find_participant(decision.fields["next"])) is not None:
+                        emit("decision", f"{p.name} is picked, waiting for the question")
+                        if isinstance(p, Bot):
+                            p.view()
+                if decision.done or decision.has("next", "reason", "question"):
+                    break
+        finally:
+            deltas.close()
+
+    def find_participant(self, name: str | None) -> Participant | None:
+        if not name:
+            return None
+        name = name.strip().lstrip("@").strip()
+        if name in self.participants:
+            return self.participants[name]
+        for key, p in self.participants.items():
+            if key.lower() == name.lower():
+                return p
+        return None
 
     def solid(self, participant, reason, question):
         msg = f"@{participant.name},{question}"
@@ -319,14 +405,16 @@ class Switch(Strategy):
             raise UserTurnInterrupt
         return [(p, "switch") for p in self.participants.values()]
 
+    def share_msg_with(self, p: Participant):
+        if p.name == self.user.name:
+            p.msg_list = self.msg_list
+            return
+        # a bot only hears the user and itself, through an index over the one shared log
+        user_name, name = self.user.name, p.name
+        p.msg_list = self.msg_list[3].filtered(lambda r: r.user_name == user_name or r.user_name == name).functions()
+
     def input(self, msg: ChatMessage):
-        if msg.user_name == self.user.name:
-            self.msg_list[1](msg)
-            for p in self.participants.values():
-                p.msg_list[1](msg)
-        else:
-            self.msg_list[1](msg)
-            self.participants[msg.user_name].msg_list[1](msg)
+        self.msg_list[1](msg)
 
     def desc_this_meeting(self):
         return "all the bots speak at the same time"
@@ -373,13 +461,26 @@ class HotPotato(AIHolder):
 
 
 class Holder(BaseModel):
-    holder_note: List[Dict]
+    holder_note: EventLog
     strategy: Strategy
     next: List[Participant] | None
     user_signal: int = 0
     status_desc: str = ""
     breathing: int = 5
     meeting_about: str = ""
+    meeting_id: str = ""
+    # share of the llm scheduler against the other meetings
+    weight: float = 1
+
+    # this meeting's share of metrics.registry, summarized in the events tab
+    _metrics: Metrics = PrivateAttr(default_factory=Metrics)
+    # the round streaming right now, user_cancel aborts it
+    _streaming: FanOut | None = PrivateAttr(default=None)
+    # participant -> (tokens, answers) of the answers they finished, to tell what a cancel saved
+    _answer_tokens: Dict[str, Tuple[int, int]] = PrivateAttr(default_factory=dict)
+
+    class Config:
+        arbitrary_types_allowed = True
 
     def desc_meeting(self):
         return f"meeting about {self.meeting_about}." + self.strategy.desc_this_meeting()
@@ -387,13 +488,19 @@ class Holder(BaseModel):
     def whats_happening(self):
         return self.status_desc
 
-    def decide_which_next(self):
+    def decide_which_next(self, tick: float | None = None):
         point = time.time()
         self.status_desc = "deciding next"
-        pairs = self.strategy.next()
+        self.check_cancel()
+        try:
+            pairs = self.meeting_context().run(self.strategy.next)
+        finally:
+            # a cancel while deciding stops here, before anyone is asked to answer
+            self.check_cancel()
+        self.observe("meeting_decision_seconds", time.time() - point, strategy=self.strategy.name)
         next_tick = []
         for p, r in pairs:
-            self.holder_note.append(dict(event=self.strategy.name, result=f"{p.name} is next, reason: {r}"))
+            self.note(self.strategy.name, f"{p.name} is next, reason: {r}")
             next_tick.append(p)
         self.next = next_tick
         if (b := self.breathing - (time.time() - point)) > 0 and not isinstance(self.next, User):
@@ -401,21 +508,28 @@ class Holder(BaseModel):
             ...
         result = None
         self.status_desc = f'{",".join([p.name for p in self.next])} is answering'
-        for line in self.parallel():
-            if self.user_signal & 1 == 1:
-                self.holder_note.append(dict(event="user cancel", result="sure"))
-                self.status_desc = "user cancel"
-                print("user cancel")
-                self.user_signal &= 0b10
-                raise UserCancel
-            result = line
-            yield result
+        point, ui = time.time(), 0.0
+        lines = self.parallel(tick)
+        try:
+            for line in lines:
+                self.check_cancel()
+                if line is not None:
+                    result = line
+                rendering = time.time()
+                yield line
+                ui += time.time() - rendering
+        finally:
+            # the upstream streams are closed here and now, not whenever the generator is collected
+            lines.close()
+        self.observe("meeting_turn_seconds", time.time() - point - ui, strategy=self.strategy.name, part="model")
+        self.observe("meeting_turn_seconds", ui, strategy=self.strategy.name, part="ui")
         for line in result:
             self.strategy.input(ChatMessage(user_name=line[0], supplement="", content=line[1]))
+        self.compact()
 
         yield {}
         if self.user_signal & 2 == 2:
-            self.holder_note.append(dict(event="user hand up", result="ok, you are next"))
+            self.note("user hand up", "ok, you are next")
             self.status_desc = "user hand up"
             print("user hand up")
             self.user_signal &= 0b01
@@ -424,44 +538,159 @@ class Holder(BaseModel):
     def input(self, msg: ChatMessage):
         self.strategy.input(msg)
 
-    def starts(self):
+    def check_cancel(self):
+        if self.user_signal & 1 == 1:
+            self.note("user cancel", "sure")
+            self.status_desc = "user cancel"
+            print("user cancel")
+            self.user_signal &= 0b10
+            raise UserCancel
+
+    def starts(self, tick: float | None = None):
+        """
+        word lines after every token, an empty one when a round goes solid. with tick a None is
+        yielded too when nothing came in for tick seconds, for a consumer that batches frames by time
+        """
         while True:
             try:
-                yield from self.decide_which_next()
+                yield from self.decide_which_next(tick)
             except (UserTurnInterrupt, UserCancel):
                 self.status_desc = "waiting for user input"
                 print("user turn")
                 return
 
-    def parallel(self):
-        ass = [(p.name, p.answer()) for p in self.next]
-        word_lines = [("", "")] * len(ass)
-        mark = {p.name for p in self.next}
-        while mark:
-            for i, k in enumerate(ass):
-                try:
-                    word = next(k[1])
-                    word_lines[i] = (k[0], word_lines[i][1] + word)
-                except StopIteration:
-                    mark.discard(k[0])
-            yield word_lines
+    def parallel(self, tick: float | None = None):
+        # build every view up front, so a User in the list still interrupts before anything streams
+        ass = [(p.name, p.answer_async()) for p in self.next]
+        # one answer is what the user waits for, a crowded round shares the meeting's slots
+        priority = WAITING if len(ass) == 1 else NORMAL
+        word_lines = [(name, "") for name, _ in ass]
+        point = time.time()
+        first, last, tokens = [None] * len(ass), [point] * len(ass), [0] * len(ass)
+        fan = self._streaming = FanOut([scheduled(stream, priority) for _, stream in ass],
+                                        self.meeting_context(), tick)
+        deltas = iter(fan)
+        try:
+            for delta in deltas:
+                if delta is None:
+                    yield None
+                    continue
+                i, word = delta
+                if word:
+                    last[i] = time.time()
+                    first[i] = first[i] or last[i]
+                    tokens[i] += 1
+                word_lines[i] = (word_lines[i][0], word_lines[i][1] + word)
+                yield word_lines
+        finally:
+            # cancelled, failed or closed by the caller: every stream is stopped before this returns
+            deltas.close()
+            self._streaming = None
+            names = [name for name, _ in ass]
+            for name, f, l, n in zip(names, first, last, tokens):
+                self.inc("participant_tokens_total", n, participant=name)
+                if f is None:
+                    continue
+                self.observe("participant_first_token_seconds", f - point, participant=name)
+                if n > 1 and l > f:
+                    self.observe("participant_tokens_per_second", (n - 1) / (l - f), participant=name)
+            self.note_tokens_saved(names, tokens, fan.finished)
+            for name, n, done in zip(names, tokens, fan.finished):
+                if done:
+                    total, answers = self._answer_tokens.get(name, (0, 0))
+                    self._answer_tokens[name] = (total + n, answers + 1)
+        yield word_lines
+
+    def note_tokens_saved(self, names: List[str], tokens: List[int], finished: List[bool]):
+        """
+        a stopped answer is guessed to have been as long as the answers its participant finished before
+        (or anyone's, for a first answer), what it had left is what the cancel saved
+        """
+        total = sum(t for t, _ in self._answer_tokens.values())
+        answers = sum(a for _, a in self._answer_tokens.values())
+        streamed, saved = [], 0
+        for name, n, done in zip(names, tokens, finished):
+            if done:
+                continue
+            t, a = self._answer_tokens.get(name, (total, answers))
+            if a:
+                saved += max(round(t / a) - n, 0)
+            streamed.append(f"{name} after {n} tokens")
+        if not streamed:
+            return
+        self.inc("llm_streams_cancelled_total", len(streamed))
+        self.inc("llm_tokens_saved_total", saved)
+        self.note("tokens saved", f"stopped {', '.join(streamed)}, about {saved} tokens not generated"
+                  if answers else f"stopped {', '.join(streamed)}")
+
+    def compact(self):
+        """
+        summarize the older part of the shared log in the background, once for every bot reading it
+        """
+        log = self.strategy.msg_list[3]
+        bots = [p for p in self.strategy.participants.values() if isinstance(p, Bot)]
+        if isinstance(getattr(self.strategy, "holder", None), Bot):
+            bots.append(self.strategy.holder)
+        # a Switch bot reads a filtered view of its own, nobody shares its context
+        if not any(b.msg_list is not None and b.msg_list[3] is log for b in bots):
+            return
+        if (summary := rolling_summary(log, create=True)) is not None:
+            summary.poke(self.meeting_context())
+
+    def inc(self, name: str, value: float = 1, **labels):
+        registry.inc(name, value, **labels)
+        self._metrics.inc(name, value, **labels)
+
+    def observe(self, name: str, value: float, **labels):
+        registry.observe(name, value, **labels)
+        self._metrics.observe(name, value, **labels)
+
+    def note(self, event: str, result: str):
+        self.holder_note.append(event, result)
+
+    def meeting_context(self) -> contextvars.Context:
+        # llm calls made inside this context report their events to this meeting
+        ctx = contextvars.copy_context()
+        ctx.run(event_sink.set, self.note)
+        ctx.run(meeting_metrics.set, self._metrics)
+        ctx.run(meeting_scope.set, (self.meeting_id or f"meeting-{id(self)}", self.weight))
+        return ctx
 
     def user_raised_hand(self):
         self.user_signal |= 2
 
     def user_cancel(self):
         self.user_signal |= 1
-
-    def to_display_log(self):
-        return "\n\n".join(
-            map(lambda x: f"--> {x['event']}: {x['result']}", self.holder_note)) + "\n\n" + self.whats_happening()
+        # from the ui's thread: the streams are closed now, not at their next token
+        for fan in (self._streaming, self.strategy._streaming):
+            if fan is not None:
+                fan.cancel()
+
+    def log_since(self, cursor: int) -> Tuple[List[str], int]:
+        """
+        the lines of the events after cursor and the cursor to ask with next time
+        """
+        events, cursor, dropped = self.holder_note.since(cursor)
+        lines = [f"--> {e['event']}: {e['result']}" for e in events]
+        if dropped:
+            lines.insert(0, f"... {dropped} events dropped")
+        return lines, cursor
+
+    def status_version(self) -> Tuple[str, int]:
+        """
+        changes whenever to_display_status would, a poll that sees the same version has nothing to send
+        """
+        return self.status_desc, self._metrics.revision
+
+    def to_display_status(self):
+        return self.whats_happening() + "\n\n#### metrics\n\n" + self._metrics.summary()
 
     def add_participant(self, p: Participant):
         self.strategy.participants[p.name] = p
 
     @classmethod
-    def new_meeting(cls, strategy: Strategy, about: str):
-        holder_note: List[Dict] = []
-        return cls(holder_note=holder_note, strategy=strategy, meeting_about=about)
+    def new_meeting(cls, strategy: Strategy, about: str, meeting_id: str = ""):
+        return cls(holder_note=EventLog(setting.event_log_size), strategy=strategy, meeting_about=about,
+                   meeting_id=meeting_id)
 
     # convert this to a context manager
@@ -1,8 +1,14 @@
-from typing import Optional, Union, List, Dict, Literal
+import time
+from typing import Optional, Union, List, Dict, Literal, Tuple
 
-import openai
 from pydantic import BaseModel
 import setting
+from .backend import pool
+from .cache import ResponseCache, replay, replay_async
+from .events import emit
+from .metrics import inc, observe
+from .ratelimit import retry, estimate_tokens
+from .tokens import count_prompt_tokens
 
 hello_message = [{"role": "system", "content": "You are a helpful assistant."},
                  {"role": "user", "content": "just answer me 'YES' 10 times"}]
@@ -13,11 +19,14 @@ class Message(BaseModel):
     content: str
 
 
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+
 class ChatParams(BaseModel):
     """
     ID of the model to use. See the model endpoint compatibility table for details on which models work with the Chat API.
     """
-    model: str = "gpt-3.5-turbo"
+    model: str = DEFAULT_MODEL
 
     """
     The messages to generate chat completions for, in the chat format.
@@ -78,32 +87,109 @@ We generally recommend altering this or temperature but not both.
     user: Optional[str]
 
 
+response_cache = ResponseCache(**setting.response_cache) if setting.response_cache else None
+
+
 def get_char_stream(stream):
     for resp in stream:
         yield resp["choices"][0]["delta"].get("content", "")
 
 
-def call_chat_create(param: ChatParams):
-    return openai.ChatCompletion.create(**param.dict(exclude_none=True))
+def cached(kwargs: Dict) -> Tuple[str | None, Dict | None]:
+    if response_cache is None:
+        return None, None
+    key = response_cache.key(kwargs)
+    hit = response_cache.get(key)
+    if hit is not None:
+        emit("cache hit", f"{key[:12]} replayed without calling openai")
+    return key, hit
+
+
+def count_request(kwargs: Dict, hit: Dict | None) -> int:
+    """
+    request metrics, returns the estimated tokens the request costs the rate limiter
+    """
+    model = kwargs["model"]
+    inc("llm_requests_total", model=model, source="openai" if hit is None else "cache")
+    if hit is not None:
+        return 0
+    prompt_tokens = count_prompt_tokens(kwargs["messages"], model)
+    inc("llm_prompt_tokens_total", prompt_tokens, model=model)
+    return estimate_tokens(kwargs, prompt_tokens)
+
+
+def first_token_timer(stream, model: str):
+    point = time.time()
+    for resp in stream:
+        if point and resp["choices"][0]["delta"].get("content"):
+            observe("llm_first_token_seconds", time.time() - point, model=model)
+            point = None
+        yield resp
 
 
-def get_stream_from_openai(messages=None):
+async def first_token_timer_async(stream, model: str):
+    point = time.time()
+    async for resp in stream:
+        if point and resp["choices"][0]["delta"].get("content"):
+            observe("llm_first_token_seconds", time.time() - point, model=model)
+            point = None
+        yield resp
+
+
+def chat_request(messages: List[Dict | Message], model: str | None = None, **kwargs) -> Dict:
+    """
+    the request exactly as it is sent. the messages are serialized dicts already (a Message is
+    turned into one), ChatParams only checks the request when setting.validate_requests is on
+    """
+    kwargs["model"] = model or DEFAULT_MODEL
+    kwargs["messages"] = [m if isinstance(m, dict) else m.dict() for m in messages]
+    if setting.validate_requests:
+        return ChatParams(**kwargs).dict(exclude_none=True)
+    return kwargs
+
+
+def call_chat_create(kwargs: Dict, backend: str | None = None):
+    key, hit = cached(kwargs)
+    tokens = count_request(kwargs, hit)
+    if hit is not None:
+        return replay(hit) if hit["stream"] else hit["response"]
+    if kwargs.get("stream"):
+        resp = first_token_timer(retry.stream(lambda: pool.create(kwargs, backend), tokens), kwargs["model"])
+    else:
+        resp = retry.call(lambda: pool.create(kwargs, backend), tokens)
+    if key is None:
+        return resp
+    if kwargs.get("stream"):
+        return response_cache.record(key, resp)
+    response_cache.put_response(key, resp)
+    return resp
+
+
+def get_stream_from_openai(messages=None, model: str | None = None, backend: str | None = None):
     if messages is None or not messages:
         raise ValueError("message sent to openai is empty")
-    return call_chat_create(ChatParams(messages=messages, stream=True))
+    return call_chat_create(chat_request(messages, model, stream=True), backend)
 
 
-def get_whole_response(messages):
-    return "".join(get_char_stream(get_stream_from_openai(messages)))
+def get_whole_response(messages, model: str | None = None, backend: str | None = None):
+    return "".join(get_char_stream(get_stream_from_openai(messages, model, backend)))
 
 
 def test_connection():
     return get_whole_response([Message(role="user", content="just answer me 'connected to openai'")])
 
 
-async def stream_response_async(msgs: List[Message]):
-    param = ChatParams(messages=msgs, stream=True)
-    stream = await openai.ChatCompletion.acreate(**param.dict(exclude_none=True))
+async def stream_response_async(msgs: List[Dict | Message], model: str | None = None, backend: str | None = None):
+    kwargs = chat_request(msgs, model, stream=True)
+    key, hit = cached(kwargs)
+    tokens = count_request(kwargs, hit)
+    if hit is not None:
+        stream = replay_async(hit)
+    else:
+        stream = retry.stream_async(lambda: pool.acreate(kwargs, backend), tokens)
+        stream = first_token_timer_async(stream, kwargs["model"])
+        if key is not None:
+            stream = response_cache.record_async(key, stream)
     async for resp in stream:
         yield resp["choices"][0]["delta"].get("content", "")
 
@@ -0,0 +1,298 @@
+import bisect
+import sys
+import threading
+from array import array
+from typing import Callable, Dict, Iterator, List
+
+from .store import SegmentLog
+
+CHUNK = 256
+USER_INVISIBLE, BOT_INVISIBLE = 1, 2
+FLAGS = {"user_invisible": USER_INVISIBLE, "bot_invisible": BOT_INVISIBLE}
+
+# a MessageRecord without its content, the names are interned and shared
+RECORD_OVERHEAD = 120
+
+
+def intern(s: str | None) -> str | None:
+    return sys.intern(s) if s is not None else None
+
+
+class MessageRecord:
+    """
+    what the log keeps of a ChatMessage. reads like one, only the visibility flags can change
+    """
+    __slots__ = ("user_name", "content", "supplement", "flags", "log", "i")
+
+    def __init__(self, log, i: int, user_name: str | None, content: str | None, supplement: str | None,
+                 user_invisible: bool = False, bot_invisible: bool = False):
+        self.user_name = intern(user_name)
+        self.content = content
+        self.supplement = intern(supplement)
+        self.flags = (USER_INVISIBLE if user_invisible else 0) | (BOT_INVISIBLE if bot_invisible else 0)
+        self.log = log
+        self.i = i
+
+    @property
+    def user_invisible(self) -> bool:
+        return bool(self.flags & USER_INVISIBLE)
+
+    @user_invisible.setter
+    def user_invisible(self, value: bool):
+        self.log.flag(self, "user_invisible", value)
+
+    @property
+    def bot_invisible(self) -> bool:
+        return bool(self.flags & BOT_INVISIBLE)
+
+    @bot_invisible.setter
+    def bot_invisible(self, value: bool):
+        self.log.flag(self, "bot_invisible", value)
+
+    def dict(self, include=None) -> Dict:
+        fields = dict(user_name=self.user_name, content=self.content, supplement=self.supplement,
+                      user_invisible=self.user_invisible, bot_invisible=self.bot_invisible)
+        if include is not None:
+            return {k: v for k, v in fields.items() if k in include}
+        return fields
+
+    def __repr__(self):
+        return f"MessageRecord({self.i}, {self.user_name}: {self.content!r})"
+
+
+class ViewCache:
+    """
+    what a participant has already mapped out of a MessageLog, a cursor into it. index holds the
+    log index of the record every item was mapped from. the ui and a streaming round may read the same
+    participant's view at once, the lock keeps them from mapping the same records twice
+    """
+    __slots__ = ("log", "revision", "cursor", "items", "index", "lock")
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset(None, 0)
+
+    def reset(self, log, revision):
+        self.log = log
+        self.revision = revision
+        self.cursor = 0
+        self.items = []
+        self.index = array("Q")
+
+    def position(self, i: int) -> int:
+        """
+        how many items were mapped from records before log index i
+        """
+        return bisect.bisect_left(self.index, i)
+
+    def advance(self, log, revision: int, end: int, map_=None) -> List:
+        """
+        map the records of log up to end that were not mapped yet, a flag flip (a new revision)
+        maps everything again. returns a copy of the items
+        """
+        with self.lock:
+            if self.log is not log or self.revision != revision:
+                self.reset(log, revision)
+            for record in log.records(self.cursor, end):
+                r = map_(record) if map_ is not None else record
+                if r is None:
+                    continue
+                self.items.append(r)
+                self.index.append(record.i)
+            self.cursor = max(self.cursor, end)
+            return list(self.items)
+
+
+class MessageLog:
+    """
+    append-only message log. records are kept in fixed size chunks, appends and flag changes take
+    the lock and readers never do: they read the length once (their snapshot) and only look at
+    records below it, which are never moved or changed except for their flags.
+
+    with a store every record is persisted and only the latest chunks stay in memory, the older
+    records are read back from the store on demand. an existing store is resumed
+    """
+
+    def __init__(self, store: SegmentLog | None = None, resident: int = 500):
+        self.store = store
+        self.resident = resident
+        # (index of the first record in memory, chunks), swapped as one when chunks are paged out
+        self.window = (0, [[]])
+        self.length = 0
+        self.revision = 0
+        self.nbytes = 0
+        self.views: List[LogView] = []
+        # records read back from the store when it was resumed, 0 for a new log
+        self.resumed = 0
+        self.lock = threading.Lock()
+        if store is not None and len(store):
+            self._resume()
+
+    def _resume(self):
+        total = len(self.store)
+        offset = max(total - self.resident, 0) // CHUNK * CHUNK
+        chunks = [[]]
+        for i, fields in enumerate(self.store.read_range(offset, total), offset):
+            if len(chunks[-1]) == CHUNK:
+                chunks.append([])
+            record = MessageRecord(self, i, **fields)
+            chunks[-1].append(record)
+            self.nbytes += self.record_bytes(record)
+        self.window = (offset, chunks)
+        self.length = self.resumed = total
+
+    @staticmethod
+    def record_bytes(record: MessageRecord) -> int:
+        return RECORD_OVERHEAD + sys.getsizeof(record.content or "")
+
+    def __len__(self):
+        return self.length
+
+    def append(self, msg) -> MessageRecord:
+        """
+        msg is a ChatMessage, a flag it flips later on still reaches the log
+        """
+        with self.lock:
+            offset, chunks = self.window
+            i = self.length
+            record = MessageRecord(self, i, msg.user_name, msg.content, msg.supplement,
+                                   msg.user_invisible, msg.bot_invisible)
+            if len(chunks[-1]) == CHUNK:
+                chunks.append([])
+            chunks[-1].append(record)
+            self.nbytes += self.record_bytes(record)
+            if self.store is not None:
+                self.store.append(record.dict())
+            for view in self.views:
+                view.offer(record)
+            # published only now, a reader never sees a record half added
+            self.length = i + 1
+            if self.store is not None and self.length - offset >= 2 * self.resident:
+                self._page_out(offset, chunks)
+        msg._touch.append(lambda key, value: setattr(record, key, value))
+        return record
+
+    def _page_out(self, offset: int, chunks: List[List[MessageRecord]]):
+        drop = (self.length - offset - self.resident) // CHUNK
+        if drop <= 0:
+            return
+        self.nbytes -= sum(self.record_bytes(r) for chunk in chunks[:drop] for r in chunk)
+        # readers holding the old window keep reading it
+        self.window = (offset + drop * CHUNK, chunks[drop:])
+
+    def flag(self, record: MessageRecord, key: str, value: bool):
+        bit = FLAGS[key]
+        with self.lock:
+            flags = record.flags | bit if value else record.flags & ~bit
+            if flags == record.flags:
+                return
+            record.flags = flags
+            self.revision += 1
+            if self.store is not None:
+                self.store.patch(record.i, key, value)
+
+    def record(self, i: int) -> MessageRecord:
+        offset, chunks = self.window
+        if i < offset:
+            return MessageRecord(self, i, **self.store.read(i))
+        return chunks[(i - offset) // CHUNK][(i - offset) % CHUNK]
+
+    def records(self, start: int, end: int) -> Iterator[MessageRecord]:
+        offset, chunks = self.window
+        if start < offset:
+            for i, fields in enumerate(self.store.read_range(start, min(end, offset)), start):
+                yield MessageRecord(self, i, **fields)
+            start = offset
+        c, j = divmod(start - offset, CHUNK)
+        left = end - start
+        while left > 0:
+            part = chunks[c][j:j + left]
+            yield from part
+            left -= len(part)
+            c, j = c + 1, 0
+
+    def at(self, index):
+        end = self.length
+        if isinstance(index, slice):
+            start, stop, step = index.indices(end)
+            if step == 1:
+                return list(self.records(start, stop))
+            return [self.at(i) for i in range(start, stop, step)]
+        i = index + end if index < 0 else index
+        if not 0 <= i < end:
+            raise IndexError("message index out of range")
+        return next(self.records(i, i + 1))
+
+    def get_msg_list(self, map_=None, index=None, cache: ViewCache | None = None):
+        if index is not None:
+            return self.at(index)
+        end = self.length
+        return (cache or ViewCache()).advance(self, self.revision, end, map_)
+
+    def push_message(self, msg):
+        self.append(msg)
+
+    def size(self) -> int:
+        return self.nbytes
+
+    def filtered(self, visible: Callable[[MessageRecord], bool]) -> "LogView":
+        """
+        the records visible says yes to, kept up to date as messages are pushed
+        """
+        with self.lock:
+            view = LogView(self, visible)
+            for record in self.records(0, self.length):
+                view.offer(record)
+            self.views.append(view)
+        return view
+
+    def functions(self):
+        return self.get_msg_list, self.push_message, self.size, self
+
+
+class LogView:
+    """
+    a participant's share of a MessageLog: the indices of the records it may see, not copies of them.
+    reads work like on the log, pushing goes to the log itself
+    """
+
+    def __init__(self, log: MessageLog, visible: Callable[[MessageRecord], bool]):
+        self.log = log
+        self.visible = visible
+        self.indices = array("Q")
+        self.nbytes = 0
+
+    def offer(self, record: MessageRecord):
+        # called under the log's lock
+        if self.visible(record):
+            self.indices.append(record.i)
+            self.nbytes += MessageLog.record_bytes(record)
+
+    def records(self, start: int, end: int) -> Iterator[MessageRecord]:
+        for i in self.indices[start:end]:
+            yield self.log.record(i)
+
+    def at(self, index):
+        end = len(self.indices)
+        if isinstance(index, slice):
+            return [self.log.record(i) for i in self.indices[:end][index]]
+        i = index + end if index < 0 else index
+        if not 0 <= i < end:
+            raise IndexError("message index out of range")
+        return self.log.record(self.indices[i])
+
+    def get_msg_list(self, map_=None, index=None, cache: ViewCache | None = None):
+        if index is not None:
+            return self.at(index)
+        end = len(self.indices)
+        return (cache or ViewCache()).advance(self, self.log.revision, end, map_)
+
+    def push_message(self, msg):
+        self.log.append(msg)
+
+    def size(self) -> int:
+        # what a view cache over these records holds, the records belong to the log
+        return self.nbytes
+
+    def functions(self):
+        return self.get_msg_list, self.push_message, self.size, self
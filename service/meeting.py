@@ -0,0 +1,162 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+
+import setting
+from .health import health
+from .holder import User, Holder, AIHolder, Bot, ChatMessageList, UserHolder, RoundRobin, Switch, Random, HotPotato, \
+    Strategy
+from .preset import CompiledMeeting, PresetCatalog
+from .store import MeetingStore
+from .tokens import count_tokens
+
+meeting_store = MeetingStore(**setting.meeting_store) if setting.meeting_store else None
+
+
+def no_progress(_):
+    pass
+
+
+def new_msg_list(meeting_id, name="main"):
+    if meeting_store is None:
+        return ChatMessageList()
+    return ChatMessageList(meeting_store.open(meeting_id, name), meeting_store.resident_messages)
+
+
+# strategy type -> (builds the strategy out of a meeting, whether the user is one of the participants it picks)
+strategies: Dict[str, Tuple[Callable[..., Strategy], bool]] = {}
+
+
+def register_strategy(type_: str, user_joins: bool = False):
+    def register(build):
+        strategies[type_] = (build, user_joins)
+        return build
+
+    return register
+
+
+@register_strategy("aiholder", user_joins=True)
+def build_ai_holder(template, msg_list, user, holder):
+    return AIHolder(msg_list=msg_list, holder=holder, choice_prompt=template.meeting.choice_prompt)
+
+
+@register_strategy("userholder")
+def build_user_holder(template, msg_list, user, holder):
+    return UserHolder(msg_list=msg_list, holder=user)
+
+
+@register_strategy("roundrobin")
+def build_round_robin(template, msg_list, user, holder):
+    return RoundRobin(sequence=template.meeting.sequence, msg_list=msg_list)
+
+
+@register_strategy("switch")
+def build_switch(template, msg_list, user, holder):
+    return Switch(user=user, msg_list=msg_list)
+
+
+@register_strategy("random")
+def build_random(template, msg_list, user, holder):
+    s = template.meeting.preset.strategy
+    return Random(user=user, msg_list=msg_list, factor=s.factor, random_plot=s.random_plot)
+
+
+@register_strategy("hotpotato", user_joins=True)
+def build_hot_potato(template, msg_list, user, holder):
+    return HotPotato(msg_list=msg_list, choice_prompt=template.meeting.choice_prompt)
+
+
+class MeetingTemplate:
+    """
+    the participants of a compiled meeting, validated once. every meeting started from it gets
+    clones of them, copied without validating again
+    """
+
+    def __init__(self, meeting: CompiledMeeting):
+        if meeting.type not in strategies:
+            raise ValueError("no such strategy")
+        self.meeting = meeting
+        self.user = User(**meeting.user)
+        self.bots = [Bot(**p) for p in meeting.bots.values()]
+        self.holder = Bot(**meeting.holder) if meeting.holder is not None else None
+        # the first turn counts these, with tiktoken that loads the encoding too
+        for bot in self.bots + ([self.holder] if self.holder else []):
+            count_tokens(bot.prompt)
+            count_tokens(bot.instruction)
+        count_tokens(meeting.choice_prompt)
+
+    def build(self, meeting_id: str) -> Tuple[Holder, User, str]:
+        build, user_joins = strategies[self.meeting.type]
+        msg_list = new_msg_list(meeting_id)
+        user = self.user.clone()
+        holder = self.holder.clone() if self.holder is not None else None
+        strategy = build(self, msg_list, user, holder)
+        if holder is not None:
+            strategy.share_msg_with(holder)
+        the_holder = Holder.new_meeting(strategy, about=self.meeting.preset.objective, meeting_id=meeting_id)
+        the_holder.weight = self.meeting.preset.weight
+        strategy.share_msg_with(user)
+        if user_joins:
+            the_holder.add_participant(user)
+        for bot in self.bots:
+            bot = bot.clone()
+            strategy.share_msg_with(bot)
+            the_holder.add_participant(bot)
+        return the_holder, user, self.meeting.desc
+
+
+class MeetingPool:
+    """
+    templates of the meetings started lately, least recently used ones are dropped past size.
+    a reloaded preset compiles to a new CompiledMeeting and so gets a new template
+    """
+
+    def __init__(self, size: int = 32):
+        self.size = size
+        self.templates: OrderedDict[CompiledMeeting, MeetingTemplate] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def template(self, meeting: CompiledMeeting) -> MeetingTemplate:
+        with self.lock:
+            template = self.templates.get(meeting)
+            if template is not None:
+                self.templates.move_to_end(meeting)
+                return template
+        template = MeetingTemplate(meeting)
+        with self.lock:
+            self.templates[meeting] = template
+            while len(self.templates) > self.size:
+                self.templates.popitem(last=False)
+        return template
+
+    def prewarm(self, catalog: PresetCatalog):
+        """
+        templates for every room of the catalog, in a thread: the first start of a room is instant too
+        """
+
+        def warm():
+            for room in catalog.rooms()[:self.size]:
+                try:
+                    self.template(catalog.get(room))
+                except (KeyError, ValueError) as e:
+                    print(f"prewarm {room} failed,", e)
+
+        threading.Thread(target=warm, daemon=True, name="meeting-prewarm").start()
+
+
+pool = MeetingPool(**setting.meeting_pool)
+
+
+def init_meeting(meeting: CompiledMeeting | Dict, meeting_id, progress=no_progress):
+    """
+    build a meeting out of a compiled preset (or one entry of a preset file's "meeting"), returns
+    the holder, the user and a description of the participants
+    """
+    if not isinstance(meeting, CompiledMeeting):
+        meeting = CompiledMeeting(meeting)
+    template = pool.template(meeting)
+    progress(0.4)
+    the_holder, user, desc = template.build(meeting_id)
+    the_holder.note("meeting_started", health.status())
+    progress(0.8)
+    return the_holder, user, desc
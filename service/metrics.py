@@ -0,0 +1,178 @@
+import bisect
+import contextvars
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+# seconds, from a cached replay to a slow answer of a long meeting
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HELP = {
+    "meeting_decision_seconds": "time the strategy took to pick the next speakers",
+    "meeting_turn_seconds": "one round of answers, part=model is waiting for the llm, part=ui is rendering frames",
+    "participant_first_token_seconds": "from the start of the round to the first token of a participant",
+    "participant_tokens_per_second": "streaming speed of a participant after its first token",
+    "participant_tokens_total": "tokens streamed by a participant",
+    "llm_requests_total": "chat completion requests, source=cache when replayed from the response cache",
+    "llm_prompt_tokens_total": "estimated prompt tokens sent",
+    "llm_first_token_seconds": "from the request to the first content token",
+    "llm_streams_cancelled_total": "answers stopped by a cancel, their http streams closed",
+    "llm_tokens_saved_total": "estimated completion tokens a cancel kept from being generated",
+    "scheduler_queue_depth": "llm requests waiting for a slot of the scheduler, by priority",
+    "scheduler_inflight": "llm requests holding a slot of the scheduler",
+    "scheduler_wait_seconds": "time an llm request waited for a slot of the scheduler",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ("buckets", "sum", "count", "recent")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        # for the percentiles of the summary, prometheus gets the buckets
+        self.recent = deque(maxlen=512)
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, p: float) -> float:
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class Metrics:
+    """
+    counters, gauges and histograms keyed by name and labels. there is one process wide registry for the
+    prometheus endpoint, and every meeting keeps its own for the summary in the events tab
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.gauges: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        # bumped on every change, a reader that saw this revision has seen everything
+        self.revision = 0
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.revision += 1
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.revision += 1
+            self.gauges.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.revision += 1
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def render(self) -> str:
+        """
+        prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} counter"]
+                lines += [f"{name}{_labels(key)} {value:g}" for key, value in series.items()]
+            for name, series in sorted(self.gauges.items()):
+                lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} gauge"]
+                lines += [f"{name}{_labels(key)} {value:g}" for key, value in series.items()]
+            for name, series in sorted(self.histograms.items()):
+                lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} histogram"]
+                for key, h in series.items():
+                    total = 0
+                    for bound, n in zip(BUCKETS + ("+Inf",), h.buckets):
+                        total += n
+                        lines.append(f"{name}_bucket{_labels(key + (('le', str(bound)),))} {total}")
+                    lines.append(f"{name}_sum{_labels(key)} {h.sum:g}")
+                    lines.append(f"{name}_count{_labels(key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """
+        one line per series, for people
+        """
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.histograms.items()):
+                for key, h in series.items():
+                    unit = "/s" if name.endswith("per_second") else "s"
+                    lines.append(f"{name}{_labels(key)}: {h.count} times, p50 {h.percentile(50):.2f}{unit}, "
+                                 f"p95 {h.percentile(95):.2f}{unit}")
+            for name, series in sorted(self.counters.items()):
+                for key, value in series.items():
+                    lines.append(f"{name}{_labels(key)}: {value:g}")
+        return "\n\n".join(lines)
+
+
+def _labels(key: Labels) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in key) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = Metrics()
+
+# the meeting an llm call is made for, set by Holder.meeting_context like events.event_sink
+meeting_metrics: contextvars.ContextVar[Metrics | None] = contextvars.ContextVar("meeting_metrics", default=None)
+
+
+def inc(name: str, value: float = 1, **labels):
+    registry.inc(name, value, **labels)
+    if (mine := meeting_metrics.get()) is not None:
+        mine.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    registry.observe(name, value, **labels)
+    if (mine := meeting_metrics.get()) is not None:
+        mine.observe(name, value, **labels)
+
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    GET /metrics in a daemon thread, next to the gradio app
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
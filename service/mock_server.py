@@ -0,0 +1,205 @@
+"""
+a local stand-in for the chat completions api, to load test meetings offline
+
+    python -m service.mock_server --port 8001 --ttft 0.4 --tokens-per-second 30 --rate-limit-rate 0.05
+
+then point a backend at it in setting.py
+
+    backends = [dict(name="mock", api_key="mock", api_base="http://127.0.0.1:8001/v1")]
+"""
+import argparse
+import itertools
+import json
+import pathlib
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict
+
+from pydantic import BaseModel
+
+
+class MockConfig(BaseModel):
+    # seconds before the first token, plus a uniform jitter of up to ttft_jitter
+    ttft: float = 0.3
+    ttft_jitter: float = 0.1
+    tokens_per_second: float = 40
+    # share of the requests answered with a 500 / a 429
+    error_rate: float = 0
+    rate_limit_rate: float = 0
+    # plain replies are cycled through, a decision request (one asking for {"next": ...}) gets a json decision
+    replies: List[str] = ["好的,我来说两句.这个问题我们可以先拆成几个小的部分,再一个一个的解决."]
+    decision_reason: str = "he knows this part best"
+    decision_question: str = "what do you think?"
+    # streams recorded earlier, they are replayed in turn instead of the replies
+    recorded: List[List[str]] = []
+
+
+def split_tokens(text: str) -> List[str]:
+    # one token per cjk character or per word with its trailing space, close enough for timing
+    return re.findall(r"[⺀-￿]|[^\s⺀-￿]+\s*|\s+", text)
+
+
+def load_recorded(path: str) -> List[List[str]]:
+    """
+    a jsonl file with one list of deltas per line, or a response cache directory (setting.response_cache)
+    """
+    path = pathlib.Path(path)
+    if path.is_dir():
+        streams = []
+        for f in sorted(path.glob("*.json")):
+            entry = json.loads(f.read_text(encoding="utf-8"))
+            if entry.get("stream"):
+                streams.append([c["choices"][0]["delta"].get("content", "") for c in entry["chunks"]])
+        return streams
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+
+class MockLLM:
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.replies = itertools.cycle(config.replies)
+        self.recorded = itertools.cycle(config.recorded) if config.recorded else None
+        self.lock = threading.Lock()
+
+    def decision(self, messages: List[Dict]) -> str | None:
+        last = messages[-1]["content"] if messages else ""
+        if '"next"' not in last:
+            return None
+        # the choice prompt lists the participants in brackets, /PARTICIPANTS/ replaced
+        names = []
+        for group in re.findall(r"\[([^\[\]]+)]", last):
+            names = [n.strip() for n in group.split(",") if n.strip()]
+        if not names:
+            names = sorted({m["content"].split(":", 1)[0] for m in messages
+                            if m["role"] == "user" and ":" in m["content"]})
+        if not names:
+            return None
+        return json.dumps(dict(next=random.choice(names), reason=self.config.decision_reason,
+                               question=self.config.decision_question), ensure_ascii=False)
+
+    def deltas(self, messages: List[Dict]) -> List[str]:
+        if (decision := self.decision(messages)) is not None:
+            return split_tokens(decision)
+        with self.lock:
+            if self.recorded is not None:
+                return next(self.recorded)
+            return split_tokens(next(self.replies))
+
+
+def chunk(completion_id: str, model: str, delta: Dict, finish_reason=None) -> bytes:
+    body = dict(id=completion_id, object="chat.completion.chunk", created=int(time.time()), model=model,
+                choices=[dict(index=0, delta=delta, finish_reason=finish_reason)])
+    return b"data: " + json.dumps(body, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+
+def make_handler(llm: MockLLM):
+    config = llm.config
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def reply_json(self, status: int, body: Dict, headers: Dict | None = None):
+            raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def error(self, status: int, message: str, kind: str, headers: Dict | None = None):
+            self.reply_json(status, dict(error=dict(message=message, type=kind, param=None, code=None)), headers)
+
+        def do_GET(self):
+            if self.path.startswith("/v1/models"):
+                model = self.path[len("/v1/models/"):] or "gpt-3.5-turbo"
+                return self.reply_json(200, dict(id=model, object="model", owned_by="mock"))
+            self.error(404, f"no route {self.path}", "invalid_request_error")
+
+        def do_POST(self):
+            if not self.path.startswith("/v1/chat/completions"):
+                return self.error(404, f"no route {self.path}", "invalid_request_error")
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            roll = random.random()
+            if roll < config.rate_limit_rate:
+                return self.error(429, "Rate limit reached (mock)", "requests", {"Retry-After": "1"})
+            if roll < config.rate_limit_rate + config.error_rate:
+                return self.error(500, "The server had an error (mock)", "server_error")
+
+            deltas = llm.deltas(request["messages"])
+            model = request.get("model", "gpt-3.5-turbo")
+            completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+            time.sleep(config.ttft + random.uniform(0, config.ttft_jitter))
+            gap = 1 / config.tokens_per_second if config.tokens_per_second else 0
+
+            if not request.get("stream"):
+                time.sleep(gap * len(deltas))
+                content = "".join(deltas)
+                return self.reply_json(200, dict(
+                    id=completion_id, object="chat.completion", created=int(time.time()), model=model,
+                    choices=[dict(index=0, message=dict(role="assistant", content=content), finish_reason="stop")],
+                    usage=dict(prompt_tokens=0, completion_tokens=len(deltas), total_tokens=len(deltas))))
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            try:
+                self.wfile.write(chunk(completion_id, model, {"role": "assistant"}))
+                for delta in deltas:
+                    self.wfile.write(chunk(completion_id, model, {"content": delta}))
+                    self.wfile.flush()
+                    time.sleep(gap)
+                self.wfile.write(chunk(completion_id, model, {}, "stop"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # the client hung up, a cancelled meeting for example
+                pass
+
+    return Handler
+
+
+def serve(config: MockConfig | None = None, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """
+    start the server in a daemon thread, port 0 picks a free one (see server.server_address)
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(MockLLM(config or MockConfig())))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="mock-openai").start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="local stand-in for the openai chat completions api")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--ttft-jitter", type=float, default=0.1)
+    parser.add_argument("--tokens-per-second", type=float, default=40)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0)
+    parser.add_argument("--reply", action="append", default=[], help="plain reply, repeatable")
+    parser.add_argument("--recorded", help="jsonl of recorded deltas or a response cache directory")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(ttft=args.ttft, ttft_jitter=args.ttft_jitter, tokens_per_second=args.tokens_per_second,
+                        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+    if args.reply:
+        config.replies = args.reply
+    if args.recorded:
+        config.recorded = load_recorded(args.recorded)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(MockLLM(config)))
+    server.daemon_threads = True
+    print(f"mock openai on http://{args.host}:{server.server_address[1]}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import copy
+import json
+import pathlib
+import threading
+import time
+import tomllib
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+from pydantic import BaseModel, ValidationError, root_validator, validator
+
+import setting
+
+# every name a preset may give a strategy, by the name the factory knows it under
+STRATEGY_TYPES = {
+    "aiholder": "aiholder", "AIHolder": "aiholder", "ai主持": "aiholder",
+    "userholder": "userholder", "UserHolder": "userholder", "用户主持": "userholder",
+    "roundrobin": "roundrobin", "RoundRobin": "roundrobin", "击鼓传花": "roundrobin",
+    "switch": "switch", "Switch": "switch", "简单并发": "switch",
+    "random": "random", "Random": "random", "随机": "random",
+    "hotpotato": "hotpotato", "HotPotato": "hotpotato", "丢手绢": "hotpotato",
+}
+
+
+class PersonPreset(BaseModel):
+    name: str
+    title: str | None = None
+    prompt: str = ""
+    instruction: str = ""
+    backend: str | None = None
+    model: str | None = None
+    context_budget: int | None = None
+
+
+class StrategyPreset(BaseModel):
+    type: str
+    holder: str | PersonPreset | None = None
+    choice_prompt: str = ""
+    factor: float = 0.2
+    random_plot: bool = False
+
+    @validator("type")
+    def known_type(cls, v):
+        if v not in STRATEGY_TYPES:
+            raise ValueError(f"no such strategy {v}")
+        return STRATEGY_TYPES[v]
+
+
+class MeetingPreset(BaseModel):
+    id: str = ""
+    objective: str = ""
+    meeting_prompt: str = ""
+    readme: str = ""
+    who_am_i: PersonPreset
+    participants: Dict[str, PersonPreset]
+    strategy: StrategyPreset
+    sequence: List[str] | None = None
+    # share of the llm scheduler against the other meetings
+    weight: float = 1
+
+    @validator("weight")
+    def positive_weight(cls, v):
+        if v <= 0:
+            raise ValueError("weight must be positive")
+        return v
+
+    @root_validator(skip_on_failure=True)
+    def known_names(cls, values):
+        names = values["participants"]
+        holder = values["strategy"].holder
+        if isinstance(holder, str) and holder not in names:
+            raise ValueError(f"holder {holder} is not a participant")
+        # the judge of a round robin is the user, it is not a participant
+        for name in values.get("sequence") or []:
+            if name not in names and name != "judge":
+                raise ValueError(f"{name} in sequence is not a participant")
+        return values
+
+
+class CompiledMeeting:
+    """
+    a validated preset with its prompts put together once: every bot's prompt with the meeting
+    prompt appended, the holder's choice prompt with /PARTICIPANTS/ filled in
+    """
+
+    def __init__(self, source: Dict):
+        # source stays as it was written, it is what a spilled meeting is rebuilt from
+        self.source = source
+        self.preset = preset = MeetingPreset.parse_obj(source)
+        self.type = preset.strategy.type
+        self.user = preset.who_am_i.dict(include={"name", "title", "prompt"})
+        self.bots = {name: self.person(p) for name, p in preset.participants.items()}
+        holder = preset.strategy.holder
+        if isinstance(holder, str):
+            holder = preset.participants[holder]
+        self.holder = self.person(holder) if holder is not None else None
+        # an ai holder asks about the user and every bot, in the order they join the meeting
+        names = [preset.who_am_i.name, *preset.participants]
+        self.choice_prompt = preset.strategy.choice_prompt.replace("/PARTICIPANTS/", ",".join(names))
+        self.sequence = preset.sequence or list(preset.participants)
+        self.desc = "\n".join(f"{name}({p.title})" for name, p in preset.participants.items()) + \
+            "\n\n\n-------------------\n" + preset.readme
+
+    def person(self, p: PersonPreset) -> Dict:
+        return dict(p.dict(exclude_none=True), prompt=f"{p.prompt}\n{self.preset.meeting_prompt}")
+
+
+def merge_patch(target, patch):
+    """
+    json merge patch (rfc 7386): objects are merged key by key, null deletes a key, anything else replaces
+    """
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+class PresetCatalog:
+    """
+    the meetings of the preset files (json or toml, later files win), parsed, validated and compiled
+    once. a file changing on disk is picked up at the next lookup, a broken edit keeps the old presets
+    """
+
+    def __init__(self, paths: List[str], check_interval: float = 1.0, max_variants: int = 64):
+        self.paths = [pathlib.Path(p) for p in paths]
+        self.check_interval = check_interval
+        self.max_variants = max_variants
+        self.stamps: Dict[pathlib.Path, float | None] = {}
+        self.checked = 0.0
+        self.room_names: List[str] = []
+        self.sources: Dict[str, Dict] = {}
+        self.compiled: Dict[str, CompiledMeeting] = {}
+        self.ids: Dict[str, str] = {}
+        self.errors: Dict[str, str] = {}
+        self.variants: OrderedDict[str, CompiledMeeting] = OrderedDict()
+        # called with the catalog after every successful reload
+        self.listeners: List[Callable[["PresetCatalog"], None]] = []
+        self.lock = threading.RLock()
+        self.reload()
+
+    @staticmethod
+    def parse(path: pathlib.Path) -> Dict:
+        text = path.read_text(encoding="utf-8")
+        if path.suffix == ".toml":
+            return tomllib.loads(text)
+        return json.loads(text) if text.strip() else {}
+
+    def _stamp(self, path: pathlib.Path) -> float | None:
+        try:
+            return path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def reload(self):
+        stamps = {path: self._stamp(path) for path in self.paths}
+        rooms, sources = [], {}
+        try:
+            for path in self.paths:
+                if stamps[path] is None:
+                    continue
+                content = self.parse(path)
+                sources.update(content.get("meeting", {}))
+                rooms += [r for r in content.get("room", content.get("meeting", {})) if r not in rooms]
+        except (ValueError, tomllib.TOMLDecodeError) as e:
+            # half saved most likely, keep serving what we have
+            print("preset reload failed,", e)
+            self.stamps = stamps
+            return
+        compiled, errors = {}, {}
+        for name, source in sources.items():
+            try:
+                compiled[name] = CompiledMeeting(source)
+            except ValidationError as e:
+                errors[name] = str(e)
+                print(f"preset {name} is invalid,", e)
+        with self.lock:
+            self.stamps = stamps
+            self.room_names = [r for r in rooms if r in compiled]
+            self.sources = sources
+            self.compiled = compiled
+            self.errors = errors
+            self.ids = {c.preset.id: name for name, c in compiled.items() if c.preset.id}
+            self.variants.clear()
+        for listener in self.listeners:
+            listener(self)
+
+    def refresh(self):
+        now = time.time()
+        if now - self.checked < self.check_interval:
+            return
+        self.checked = now
+        if any(self._stamp(path) != self.stamps.get(path) for path in self.paths):
+            self.reload()
+
+    def rooms(self) -> List[str]:
+        self.refresh()
+        return list(self.room_names)
+
+    def name(self, room: str) -> str:
+        self.refresh()
+        with self.lock:
+            if room in self.compiled:
+                return room
+            if room in self.ids:
+                return self.ids[room]
+        raise KeyError(f"no such meeting {room}")
+
+    def source(self, room: str) -> Dict:
+        return copy.deepcopy(self.sources[self.name(room)])
+
+    def get(self, room: str, overrides: Dict | None = None) -> CompiledMeeting:
+        """
+        room is a meeting name or a preset id, overrides a merge patch over the preset
+        """
+        name = self.name(room)
+        with self.lock:
+            if not overrides:
+                return self.compiled[name]
+            key = name + json.dumps(overrides, sort_keys=True, ensure_ascii=False)
+            if key in self.variants:
+                self.variants.move_to_end(key)
+                return self.variants[key]
+            source = self.sources[name]
+        compiled = CompiledMeeting(merge_patch(source, overrides))
+        with self.lock:
+            self.variants[key] = compiled
+            while len(self.variants) > self.max_variants:
+                self.variants.popitem(last=False)
+        return compiled
+
+
+catalog = PresetCatalog(setting.presets)
@@ -0,0 +1,179 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Callable, Iterator
+
+import openai
+
+import setting
+from .events import emit
+from .tokens import count_prompt_tokens
+
+# what an answer usually costs when the request does not cap it with max_tokens
+COMPLETION_GUESS = 256
+
+RETRYABLE = (openai.error.RateLimitError, openai.error.Timeout, openai.error.APIConnectionError,
+             openai.error.ServiceUnavailableError)
+
+
+def estimate_tokens(kwargs, prompt_tokens: int | None = None) -> int:
+    if prompt_tokens is None:
+        prompt_tokens = count_prompt_tokens(kwargs["messages"], kwargs.get("model", "gpt-3.5-turbo"))
+    return prompt_tokens + (kwargs.get("max_tokens") or COMPLETION_GUESS)
+
+
+class TokenBucket:
+    """
+    refills rate_per_minute units evenly over a minute. reserve takes the units right away,
+    the balance may go negative, and says how long the caller has to wait to be in line
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60
+        self.level = rate_per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            self.level -= min(amount, self.capacity)
+            return max(0.0, -self.level / self.rate)
+
+
+class RateLimiter:
+    """
+    process wide requests per minute and tokens per minute limits
+    """
+
+    def __init__(self, requests_per_minute: float | None = None, tokens_per_minute: float | None = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, tokens: int) -> float:
+        wait = 0.0
+        if self.requests:
+            wait = self.requests.reserve(1)
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        if wait > 0:
+            emit("throttled", f"waiting {wait:.1f}s for the openai rate limit ({tokens} tokens)")
+        return wait
+
+    def acquire(self, tokens: int):
+        if wait := self.reserve(tokens):
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int):
+        if wait := self.reserve(tokens):
+            await asyncio.sleep(wait)
+
+
+class RetryBudget:
+    """
+    every request earns ratio of a retry, so during an outage retries add at most ratio more load
+    """
+
+    def __init__(self, ratio: float = 0.2, reserve: float = 10):
+        self.ratio = ratio
+        self.cap = reserve
+        self.balance = reserve
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.balance = min(self.cap, self.balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+class Retry:
+    """
+    jittered exponential backoff around openai calls, a stream that breaks before its first
+    token is opened again, once tokens went out the error goes up to the caller
+    """
+
+    def __init__(self, limiter: RateLimiter, budget: RetryBudget, max_attempts: int = 5, base_delay: float = 0.5,
+                 max_delay: float = 20):
+        self.limiter = limiter
+        self.budget = budget
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def retryable(e: Exception) -> bool:
+        if isinstance(e, RETRYABLE):
+            return True
+        return isinstance(e, openai.error.APIError) and (e.http_status or 500) >= 500
+
+    def backoff(self, attempt: int, e: Exception) -> float | None:
+        """
+        seconds to wait before the next attempt, None when we should give up
+        """
+        if not self.retryable(e) or attempt + 1 >= self.max_attempts or not self.budget.withdraw():
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        emit("retry", f"{type(e).__name__} on attempt {attempt + 1}, retry in {delay:.1f}s")
+        return delay
+
+    def call(self, create: Callable, tokens: int):
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            try:
+                return create()
+            except Exception as e:
+                if (delay := self.backoff(attempt, e)) is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    def stream(self, create: Callable, tokens: int) -> Iterator:
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            started = False
+            try:
+                for chunk in create():
+                    started = started or bool(chunk["choices"][0]["delta"].get("content"))
+                    yield chunk
+                return
+            except Exception as e:
+                if started or (delay := self.backoff(attempt, e)) is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    async def stream_async(self, create: Callable, tokens: int):
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            await self.limiter.acquire_async(tokens)
+            started = False
+            try:
+                async for chunk in await create():
+                    started = started or bool(chunk["choices"][0]["delta"].get("content"))
+                    yield chunk
+                return
+            except Exception as e:
+                if started or (delay := self.backoff(attempt, e)) is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+retry = Retry(RateLimiter(**(setting.rate_limit or {})), RetryBudget(setting.retry["budget_ratio"]),
+              max_attempts=setting.retry["max_attempts"], base_delay=setting.retry["base_delay"],
+              max_delay=setting.retry["max_delay"])
@@ -0,0 +1,63 @@
+import time
+from typing import Iterable, Iterator, List, Tuple
+
+import setting
+from .holder import User
+
+
+class ChatRenderer:
+    """
+    keeps the user's rendered transcript between frames, it is only refreshed when a round goes solid
+    (User.view maps just the new messages) and only the in-flight bot lines are rebuilt for every token
+    """
+
+    def __init__(self, user: User, window: int | None = None):
+        self.user = user
+        self.window = setting.chat_history_window if window is None else window
+        self.rendered: List[Tuple[str | None, str | None]] = []
+
+    def refresh(self):
+        self.rendered = self.user.view()
+
+    def history(self):
+        if self.window:
+            return self.rendered[-self.window:]
+        return list(self.rendered)
+
+    def frame(self, lines=None):
+        """
+        lines are the word_lines yielded by Holder.starts, an empty one means the round went solid
+        """
+        if not lines:
+            self.refresh()
+            return self.history()
+        history = self.history()
+        for name, content in lines:
+            history.append((None, f"{name}: {content}"))
+        return history
+
+
+def coalesce(frames: Iterable, interval: float = 0.05, max_chars: int = 200) -> Iterator:
+    """
+    batch the word lines of Holder.starts(tick=...) into fewer frames: the latest lines are passed on once
+    interval seconds went by or max_chars of new text came in since the last frame. the end of a round
+    (an empty one) is passed on right away, after the last lines of the round
+    """
+    pending, sent_at, sent_chars = None, time.monotonic(), 0
+    for lines in frames:
+        if lines is not None and not lines:
+            if pending is not None:
+                yield pending
+            yield lines
+            pending, sent_at, sent_chars = None, time.monotonic(), 0
+            continue
+        if lines is not None:
+            # the same list every token of a round, it always holds the latest text
+            pending = lines
+        if pending is None:
+            continue
+        chars = sum(len(content) for _, content in pending)
+        now = time.monotonic()
+        if now - sent_at >= interval or chars - sent_chars >= max_chars:
+            yield pending
+            pending, sent_at, sent_chars = None, now, chars
@@ -0,0 +1,236 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Dict, List, Tuple
+
+import setting
+from .events import emit
+from .metrics import registry
+
+# the participant the user is looking at right now, the rest of a crowded round, work nobody waits for
+WAITING, NORMAL, BACKGROUND = range(3)
+PRIORITY_NAMES = ("waiting", "normal", "background")
+
+# a wait longer than this is noted in the meeting's events
+SLOW_WAIT = 1.0
+
+# (meeting id, weight) of the meeting a request is made for, set by Holder.meeting_context
+meeting_scope: ContextVar[Tuple[str, float] | None] = ContextVar("meeting_scope", default=None)
+
+
+class Waiter:
+    __slots__ = ("flow", "priority", "tag", "seq", "wake", "queued", "granted", "cancelled")
+
+    def __init__(self, flow: "Flow", priority: int, tag: float, seq: int, wake: Callable[[], None]):
+        self.flow = flow
+        self.priority = priority
+        self.tag = tag
+        self.seq = seq
+        self.wake = wake
+        self.queued = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+
+    def __lt__(self, other: "Waiter"):
+        return (self.priority, self.tag, self.seq) < (other.priority, other.tag, other.seq)
+
+
+class Flow:
+    """
+    the requests of one meeting
+    """
+    __slots__ = ("name", "weight", "finish", "inflight", "waiting")
+
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = weight
+        # virtual time its last queued request ends at
+        self.finish = 0.0
+        self.inflight = 0
+        self.waiting: List[Waiter] = []
+
+
+class Scheduler:
+    """
+    process wide gate in front of the llm requests of every meeting: at most max_inflight at once and
+    per_meeting of one meeting. the queued requests are let through by priority first, then by start time
+    fair queuing over the meetings: every request of a meeting moves its virtual clock on by 1 / weight,
+    so a meeting with twenty bots waiting does not hold back one with a single bot.
+
+    waiting works from any thread and any event loop, every meeting streams on a loop of its own
+    """
+
+    def __init__(self, max_inflight: int = 64, per_meeting: int = 8):
+        self.max_inflight = max_inflight
+        self.per_meeting = per_meeting
+        self.inflight = 0
+        self.depth = [0] * len(PRIORITY_NAMES)
+        self.flows: Dict[str, Flow] = {}
+        # start tag of the latest request let through
+        self.virtual = 0.0
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def _enqueue(self, name: str, weight: float, priority: int, wake: Callable[[], None]) -> Waiter:
+        with self.lock:
+            flow = self.flows.get(name)
+            if flow is None:
+                flow = self.flows[name] = Flow(name, weight)
+            tag = max(self.virtual, flow.finish)
+            flow.finish = tag + 1 / flow.weight
+            waiter = Waiter(flow, priority, tag, next(self.counter), wake)
+            heapq.heappush(flow.waiting, waiter)
+            self.depth[priority] += 1
+            self._dispatch()
+            return waiter
+
+    def _dispatch(self):
+        # under the lock
+        while self.inflight < self.max_inflight:
+            best = None
+            for flow in list(self.flows.values()):
+                if self._prune(flow):
+                    continue
+                if flow.waiting and flow.inflight < self.per_meeting and (best is None or flow.waiting[0] < best):
+                    best = flow.waiting[0]
+            if best is None:
+                break
+            heapq.heappop(best.flow.waiting)
+            self.depth[best.priority] -= 1
+            try:
+                best.wake()
+            except RuntimeError:
+                # its event loop is gone, nobody is waiting for it anymore
+                best.cancelled = True
+                continue
+            best.granted = True
+            best.flow.inflight += 1
+            self.inflight += 1
+            self.virtual = max(self.virtual, best.tag)
+            registry.observe("scheduler_wait_seconds", time.monotonic() - best.queued,
+                             priority=PRIORITY_NAMES[best.priority])
+        self._export()
+
+    def _prune(self, flow: Flow) -> bool:
+        """
+        drop the cancelled waiters at the head of flow, and flow itself once nothing of it is left.
+        True when it was dropped, under the lock
+        """
+        while flow.waiting and flow.waiting[0].cancelled:
+            heapq.heappop(flow.waiting)
+        if flow.waiting or flow.inflight:
+            return False
+        if self.flows.get(flow.name) is flow:
+            del self.flows[flow.name]
+        return True
+
+    def _export(self):
+        for priority, name in enumerate(PRIORITY_NAMES):
+            registry.set("scheduler_queue_depth", self.depth[priority], priority=name)
+        registry.set("scheduler_inflight", self.inflight)
+
+    def _cancel(self, waiter: Waiter) -> bool:
+        """
+        drop a waiter that gave up, True when it had been let through already and holds a slot
+        """
+        with self.lock:
+            if waiter.granted:
+                return True
+            if waiter.cancelled:
+                # dropped by _dispatch already, its loop was gone
+                return False
+            waiter.cancelled = True
+            self.depth[waiter.priority] -= 1
+            # a meeting whose only request gave up leaves nothing behind
+            self._prune(waiter.flow)
+            self._export()
+            return False
+
+    def release(self, waiter: Waiter):
+        with self.lock:
+            flow = waiter.flow
+            flow.inflight -= 1
+            self.inflight -= 1
+            self._prune(flow)
+            self._dispatch()
+
+    @staticmethod
+    def _noted(waiter: Waiter):
+        waited = time.monotonic() - waiter.queued
+        if waited > SLOW_WAIT:
+            emit("queued", f"waited {waited:.1f}s for a free llm slot ({PRIORITY_NAMES[waiter.priority]})")
+
+    def acquire(self, name: str, weight: float, priority: int) -> Waiter:
+        granted = threading.Event()
+        waiter = self._enqueue(name, weight, priority, granted.set)
+        try:
+            granted.wait()
+        except BaseException:
+            if self._cancel(waiter):
+                self.release(waiter)
+            raise
+        self._noted(waiter)
+        return waiter
+
+    async def acquire_async(self, name: str, weight: float, priority: int) -> Waiter:
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def resolve():
+            if not granted.done():
+                granted.set_result(None)
+
+        waiter = self._enqueue(name, weight, priority, lambda: loop.call_soon_threadsafe(resolve))
+        try:
+            await granted
+        except BaseException:
+            # cancelled while queued, or let through just as it was cancelled
+            if self._cancel(waiter):
+                self.release(waiter)
+            raise
+        self._noted(waiter)
+        return waiter
+
+
+scheduler = Scheduler(**setting.scheduler) if setting.scheduler else None
+
+
+def _scope() -> Tuple[str, float]:
+    # a call outside any meeting (the health check) queues as a meeting of its own
+    return meeting_scope.get() or ("", 1.0)
+
+
+@contextlib.contextmanager
+def slot(priority: int = NORMAL):
+    """
+    hold one of the scheduler's slots for the meeting in the current context
+    """
+    if scheduler is None:
+        yield
+        return
+    waiter = scheduler.acquire(*_scope(), priority)
+    try:
+        yield
+    finally:
+        scheduler.release(waiter)
+
+
+async def scheduled(stream: AsyncIterator[str], priority: int = NORMAL) -> AsyncIterator[str]:
+    """
+    stream once a slot is free, the request under it is only sent then. the slot is held until the
+    stream ends, fails or is cancelled
+    """
+    if scheduler is None:
+        async for delta in stream:
+            yield delta
+        return
+    waiter = await scheduler.acquire_async(*_scope(), priority)
+    try:
+        async for delta in stream:
+            yield delta
+    finally:
+        scheduler.release(waiter)
@@ -0,0 +1,269 @@
+import contextlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict
+
+import setting
+from .holder import Holder, Participant, User
+from .meeting import init_meeting, meeting_store, no_progress
+from .preset import CompiledMeeting
+from .render import ChatRenderer
+
+
+class SessionBusy(RuntimeError):
+    """
+    the meeting is answering for another handler (another tab), one round runs at a time
+    """
+
+
+class RoomMismatch(ValueError):
+    """
+    the id belongs to a meeting of another room
+    """
+
+
+class Session:
+    """
+    one live meeting, the browser only keeps its id
+    """
+
+    def __init__(self, session_id: str, meeting: Dict, holder: Holder, user: User, participants: str,
+                 room: str | None = None):
+        self.id = session_id
+        # the room it was started in, an id is only resumed in the same room
+        self.room = room
+        # the preset entry as written (overrides merged in), to build the meeting again after a spill
+        self.meeting = meeting
+        self.holder = holder
+        self.user = user
+        self.participants = participants
+        self.renderer = ChatRenderer(user)
+        self.last_used = time.time()
+        self.active = 0
+        self.evicted = False
+        self.lock = threading.Lock()
+
+    def touch(self):
+        self.last_used = time.time()
+
+    @contextlib.contextmanager
+    def busy(self):
+        """
+        a handler is streaming for this meeting, an idle sweep cancels it instead of dropping it underneath.
+        only one at a time, two rounds on one holder would mix their strategy state
+        """
+        with self.lock:
+            if self.active:
+                raise SessionBusy(self.id)
+            self.active += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.active -= 1
+                done = self.evicted and not self.active
+            self.touch()
+            if not self.evicted:
+                self.save()
+            if done:
+                close_store(self)
+
+    def save(self):
+        """
+        write what the meeting is built again from next to its segments: the preset, the room, the strategy
+        state and the events. done when it is created, after every round and when it is dropped
+        """
+        if meeting_store is None:
+            return
+        state = self.holder.strategy.dict(exclude={"participants", "msg_list", "holder", "user"})
+        path = spill_path(self.id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # a crash halfway through the write leaves the last one
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(dict(
+            meeting=self.meeting, room=self.room, holder_note=self.holder.holder_note.dump(), strategy=state,
+            saved=time.time()), ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    def nbytes(self) -> int:
+        """
+        the messages in memory, once for the log and once more for every participant view caching them
+        """
+        strategy = self.holder.strategy
+        owners = [strategy, *strategy.participants.values()]
+        if isinstance(getattr(strategy, "holder", None), Participant):
+            owners.append(strategy.holder)
+        logs, cached = {}, 0
+        for owner in owners:
+            msg_list = getattr(owner, "msg_list", None)
+            if not msg_list:
+                continue
+            # a filtered view only indexes its log
+            log = getattr(msg_list[3], "log", msg_list[3])
+            logs[id(log)] = log
+            if getattr(owner, "_view_cache", None) is not None and owner._view_cache.items:
+                cached += msg_list[2]()
+        return sum(log.size() for log in logs.values()) + cached
+
+
+def close_store(session: Session):
+    if meeting_store is not None:
+        meeting_store.close(session.id)
+
+
+def spill_path(session_id: str):
+    return meeting_store.root / session_id / "session.json"
+
+
+class SessionRegistry:
+    """
+    live meetings by id. a meeting idle for idle_ttl seconds is dropped, and so are the least recently
+    used ones once there are more than max_meetings or together they take more than max_bytes.
+    with a meeting store every meeting keeps a session.json next to its messages, a dropped meeting is
+    spilled once more first, and it is built again the next time its id is asked for, after a restart too
+    """
+
+    def __init__(self, idle_ttl: float = 1800, max_meetings: int = 200, max_bytes: int | None = None,
+                 spill: bool = True, sweep_interval: float = 30):
+        self.idle_ttl = idle_ttl
+        self.max_meetings = max_meetings
+        self.max_bytes = max_bytes
+        self.spill = spill and meeting_store is not None
+        self.sweep_interval = sweep_interval
+        self.sessions: OrderedDict[str, Session] = OrderedDict()
+        self.lock = threading.RLock()
+        self.sweeper = None
+
+    def start(self):
+        if self.sweeper is None:
+            self.sweeper = threading.Thread(target=self._sweep_forever, daemon=True, name="session-sweeper")
+            self.sweeper.start()
+
+    def create(self, session_id: str, meeting: CompiledMeeting | Dict, progress=no_progress,
+               room: str | None = None) -> Session:
+        """
+        the live meeting with this id, the saved one, or a new one out of the preset. an id started in
+        another room than room raises RoomMismatch
+        """
+        if (session := self.get(session_id)) is not None:
+            if room is not None and session.room not in (None, room):
+                raise RoomMismatch(f"meeting {session_id} was started in {session.room}")
+            if session.active:
+                # open in another tab and answering right now
+                raise SessionBusy(session_id)
+            return session
+        if not isinstance(meeting, CompiledMeeting):
+            meeting = CompiledMeeting(meeting)
+        holder, user, participants = init_meeting(meeting, session_id, progress)
+        session = Session(session_id, meeting.source, holder, user, participants, room)
+        session.save()
+        return self.add(session)
+
+    def add(self, session: Session) -> Session:
+        with self.lock:
+            self.sessions[session.id] = session
+            self.sessions.move_to_end(session.id)
+        self.enforce(keep=session.id)
+        return session
+
+    def get(self, session_id: str | None, touch: bool = True) -> Session | None:
+        """
+        the live session, restored from its spill if needed. touch=False only peeks: a poll neither keeps
+        a meeting alive nor brings a spilled one back, or every open tab would undo the eviction
+        """
+        if not session_id:
+            return None
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                if touch:
+                    self.sessions.move_to_end(session_id)
+                    session.touch()
+                return session
+            if not touch:
+                return None
+            session = self.restore(session_id)
+            if session is None:
+                return None
+            self.sessions[session_id] = session
+        self.enforce(keep=session_id)
+        return session
+
+    def restore(self, session_id: str) -> Session | None:
+        """
+        the meeting built again from its session.json, after an eviction or a restart
+        """
+        if meeting_store is None or not spill_path(session_id).is_file():
+            return None
+        saved = json.loads(spill_path(session_id).read_text(encoding="utf-8"))
+        holder, user, participants = init_meeting(saved["meeting"], session_id)
+        holder.holder_note.load(saved["holder_note"])
+        for key, value in saved["strategy"].items():
+            setattr(holder.strategy, key, value)
+        # spills of an older version have no room and call it spilled
+        saved_at = saved.get("saved", saved.get("spilled"))
+        holder.note("session restored", f"saved {time.time() - saved_at:.0f}s ago")
+        return Session(session_id, saved["meeting"], holder, user, participants, saved.get("room"))
+
+    def evict(self, session_id: str, reason: str):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        print(f"session {session_id} evicted, {reason}")
+        session.holder.note("session evicted", reason)
+        if self.spill:
+            session.save()
+        with session.lock:
+            session.evicted = True
+            active = session.active
+        if active:
+            # the streaming handler stops at its next token and closes the upstream streams on its way out
+            session.holder.user_cancel()
+        else:
+            close_store(session)
+
+    def enforce(self, keep: str | None = None):
+        """
+        drop the least recently used meetings until the caps hold, busy ones are skipped
+        """
+        while True:
+            with self.lock:
+                over_count = len(self.sessions) > self.max_meetings
+                over_bytes = self.max_bytes is not None and self.nbytes() > self.max_bytes
+                if not (over_count or over_bytes):
+                    return
+                victim = next((s for s in self.sessions.values() if not s.active and s.id != keep), None)
+            if victim is None:
+                return
+            self.evict(victim.id, "too many meetings" if over_count else "memory cap reached")
+
+    def sweep(self):
+        now = time.time()
+        with self.lock:
+            idle = [s for s in self.sessions.values() if now - s.last_used > self.idle_ttl]
+        for session in idle:
+            # a stream nobody read for idle_ttl seconds belongs to a closed tab
+            self.evict(session.id, f"idle for {now - session.last_used:.0f}s")
+        self.enforce()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print("session sweep failed,", e)
+
+    def nbytes(self) -> int:
+        with self.lock:
+            return sum(s.nbytes() for s in self.sessions.values())
+
+    def desc(self) -> str:
+        with self.lock:
+            return f"{len(self.sessions)} meetings, about {self.nbytes() / 1024 / 1024:.1f}MB"
+
+
+sessions = SessionRegistry(**setting.sessions)
@@ -0,0 +1,173 @@
+import json
+import os
+import pathlib
+import threading
+import time
+from array import array
+from typing import Dict, Iterator, List
+
+
+class SegmentLog:
+    """
+    append-only jsonl log split in numbered segment files. every message is one line,
+    a later flag change is one more line patching it, so nothing is ever rewritten.
+
+    appends are flushed right away but fsync'ed in batches, every fsync_batch records or
+    fsync_interval seconds (see MeetingStore's flusher), whatever comes first.
+    """
+
+    def __init__(self, path: pathlib.Path, segment_size: int = 10000, fsync_batch: int = 32):
+        self.path = path
+        self.segment_size = segment_size
+        self.fsync_batch = fsync_batch
+        self.segments = array("I")
+        self.offsets = array("Q")
+        self.patches: Dict[int, Dict] = {}
+        self.unsynced = 0
+        self.lock = threading.RLock()
+        path.mkdir(parents=True, exist_ok=True)
+        self.segment = 0
+        self.lines_in_segment = 0
+        self.file = None
+        self._load()
+
+    def _segment_path(self, n: int) -> pathlib.Path:
+        return self.path / f"{n:06d}.jsonl"
+
+    def _load(self):
+        for seg_path in sorted(self.path.glob("*.jsonl")):
+            n = int(seg_path.stem)
+            self.segment, self.lines_in_segment = n, 0
+            torn = False
+            with seg_path.open("rb") as f:
+                offset = f.tell()
+                for line in iter(f.readline, b""):
+                    if not line.endswith(b"\n"):
+                        torn = True
+                        break
+                    self._index(json.loads(line), n, offset)
+                    self.lines_in_segment += 1
+                    offset = f.tell()
+            if torn:
+                # half a line from a crash, drop it so the next append starts clean
+                with seg_path.open("r+b") as f:
+                    f.truncate(offset)
+
+    def _index(self, record: Dict, segment: int, offset: int):
+        if record["op"] == "msg":
+            self.segments.append(segment)
+            self.offsets.append(offset)
+        else:
+            self.patches.setdefault(record["i"], {})[record["key"]] = record["value"]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _write(self, record: Dict):
+        if self.lines_in_segment >= self.segment_size:
+            self.close()
+            self.segment += 1
+            self.lines_in_segment = 0
+        if self.file is None:
+            self.file = self._segment_path(self.segment).open("ab")
+        offset = self.file.tell()
+        self.file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        self.file.flush()
+        self.lines_in_segment += 1
+        self._index(record, self.segment, offset)
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_batch:
+            self._sync()
+
+    def append(self, fields: Dict) -> int:
+        with self.lock:
+            self._write(dict(fields, op="msg"))
+            return len(self.offsets) - 1
+
+    def patch(self, i: int, key: str, value):
+        with self.lock:
+            self._write(dict(op="flag", i=i, key=key, value=value))
+
+    def _sync(self):
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    def _message(self, i: int, record: Dict) -> Dict:
+        del record["op"]
+        record.update(self.patches.get(i, {}))
+        return record
+
+    def read(self, i: int) -> Dict:
+        with self.lock, self._segment_path(self.segments[i]).open("rb") as f:
+            f.seek(self.offsets[i])
+            return self._message(i, json.loads(f.readline()))
+
+    def read_range(self, start: int, end: int) -> Iterator[Dict]:
+        """
+        messages [start, end) in order, every segment file is opened once
+        """
+        i = start
+        while i < end:
+            n = self.segments[i]
+            with self._segment_path(n).open("rb") as f:
+                f.seek(self.offsets[i])
+                while i < end and self.segments[i] == n:
+                    record = json.loads(f.readline())
+                    if record["op"] != "msg":
+                        continue
+                    yield self._message(i, record)
+                    i += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self._sync()
+                self.file.close()
+                self.file = None
+
+
+class MeetingStore:
+    """
+    one directory per meeting under root, one SegmentLog per message list of the meeting
+    """
+
+    def __init__(self, root: str, segment_size: int = 10000, fsync_batch: int = 32, fsync_interval: float = 1.0,
+                 resident_messages: int = 500):
+        self.root = pathlib.Path(root)
+        self.segment_size = segment_size
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.resident_messages = resident_messages
+        self.logs: Dict[str, SegmentLog] = {}
+        self.lock = threading.Lock()
+        threading.Thread(target=self._flush, daemon=True, name="meeting-store-flusher").start()
+
+    def exists(self, meeting_id: str) -> bool:
+        return (self.root / meeting_id).is_dir()
+
+    def open(self, meeting_id: str, name: str = "main") -> SegmentLog:
+        key = f"{meeting_id}/{name}"
+        with self.lock:
+            if key not in self.logs:
+                self.logs[key] = SegmentLog(self.root / meeting_id / name, self.segment_size, self.fsync_batch)
+            return self.logs[key]
+
+    def close(self, meeting_id: str):
+        with self.lock:
+            keys = [k for k in self.logs if k.startswith(f"{meeting_id}/")]
+            logs = [self.logs.pop(k) for k in keys]
+        for log in logs:
+            log.close()
+
+    def _flush(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            with self.lock:
+                logs: List[SegmentLog] = list(self.logs.values())
+            for log in logs:
+                log.sync()
@@ -0,0 +1,130 @@
+import contextvars
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import setting
+from .events import emit
+from .llm import get_whole_response
+from .log import MessageLog, MessageRecord
+from .scheduler import BACKGROUND, slot
+
+SUMMARY_PROMPT = "You keep the minutes of a meeting. Merge the minutes so far and the new part of the " \
+                 "transcript into new minutes: who said what, what was agreed, what is still open. " \
+                 "Keep names, numbers and decisions, drop small talk. Write in the language of the transcript, " \
+                 "at most {words} words."
+
+executor = ThreadPoolExecutor(max_workers=(setting.rolling_summary or {}).get("workers", 2),
+                              thread_name_prefix="summary")
+
+
+class RollingSummary:
+    """
+    minutes of the start of a shared log, rolled forward one segment at a time in the background: every
+    summary covers a range of the log and is built from the one before it plus the next segment. the
+    latest keep_recent messages are never summarized, the participants read them as they are.
+
+    the log's bot_invisible flags are read when a segment is summarized, a flag flipped later on
+    does not change a summary already made
+    """
+
+    def __init__(self, log: MessageLog, segment: int = 40, keep_recent: int = 40, max_tokens: int = 300,
+                 model: str | None = None, keep: int = 4, **_):
+        self.log = log
+        self.segment = segment
+        self.keep_recent = keep_recent
+        self.max_tokens = max_tokens
+        self.model = model
+        self.keep = keep
+        # (start, end) -> minutes of the records in [start, end), the latest few
+        self.summaries: Dict[Tuple[int, int], str] = {}
+        self.latest: Tuple[int, int] | None = None
+        self.running = False
+        self.lock = threading.Lock()
+
+    def due(self) -> Tuple[int, int] | None:
+        """
+        the range the next summary covers, None while the log has not grown a segment past the last one
+        """
+        limit = (len(self.log) - self.keep_recent) // self.segment * self.segment
+        if self.latest is None:
+            # a new log starts from 0, so minutes always cover everything the bots no longer read. a meeting
+            # resumed from the store starts one segment before what it had, its earlier minutes are lost
+            resumed = (self.log.resumed - self.keep_recent) // self.segment * self.segment
+            start = max(resumed - self.segment, 0)
+            return (start, start + self.segment) if start + self.segment <= limit else None
+        start, end = self.latest
+        return (start, end + self.segment) if end + self.segment <= limit else None
+
+    def poke(self, context: contextvars.Context | None = None):
+        """
+        start rolling if a segment is due, at most one roll per log at a time
+        """
+        with self.lock:
+            if self.running or self.due() is None:
+                return
+            self.running = True
+        executor.submit((context or contextvars.copy_context()).run, self._roll)
+
+    def _roll(self):
+        try:
+            while (due := self.due()) is not None:
+                start, end = due
+                previous = self.summaries.get(self.latest) if self.latest else None
+                added = self.latest[1] if self.latest else start
+                text = self.summarize(previous, list(self.log.records(added, end)))
+                with self.lock:
+                    self.summaries[due] = text
+                    self.latest = due
+                    for key in list(self.summaries)[:-self.keep]:
+                        del self.summaries[key]
+                emit("summary", f"messages {start}-{end} summarized")
+        except Exception as e:
+            # the participants keep reading the whole log, the next round tries again
+            emit("summary failed", f"{type(e).__name__}: {e}")
+        finally:
+            with self.lock:
+                self.running = False
+
+    def summarize(self, previous: str | None, records: List[MessageRecord]) -> str:
+        transcript = "\n".join(f"{r.user_name}: {r.content}" for r in records if not r.bot_invisible)
+        content = f"minutes so far:\n{previous}\n\n" if previous else ""
+        content += f"new part of the transcript:\n{transcript}"
+        # the minutes can wait for the answers of every meeting
+        with slot(BACKGROUND):
+            return get_whole_response([dict(role="system", content=SUMMARY_PROMPT.format(words=self.max_tokens)),
+                                       dict(role="user", content=content)], self.model)
+
+    def get(self) -> Tuple[int, int, str] | None:
+        """
+        (start, end, minutes) of the latest summary
+        """
+        with self.lock:
+            if self.latest is None:
+                return None
+            return *self.latest, self.summaries[self.latest]
+
+
+_summaries: "weakref.WeakKeyDictionary[MessageLog, RollingSummary]" = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def rolling_summary(log, create: bool = False) -> RollingSummary | None:
+    """
+    the summary shared by every participant reading log, None for a filtered view or when turned off
+    """
+    if not setting.rolling_summary or not isinstance(log, MessageLog):
+        return None
+    summary = _summaries.get(log)
+    if summary is not None or not create:
+        return summary
+    with _lock:
+        if (summary := _summaries.get(log)) is None:
+            summary = _summaries[log] = RollingSummary(log, **setting.rolling_summary)
+        return summary
+
+
+def summary_message(start: int, end: int, minutes: str) -> Dict:
+    earlier = f", the {start} messages before them are left out" if start else ""
+    return dict(role="user", content=f"(minutes of messages {start}-{end} of this meeting{earlier})\n{minutes}")
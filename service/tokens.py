@@ -0,0 +1,44 @@
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# every message is wrapped as <|start|>{role}\n{content}<|end|>\n by the chat format
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """
+    exact with tiktoken installed, otherwise a cheap local estimate:
+    one token per CJK character and one per four other characters
+    """
+    if not text:
+        return 0
+    return _count_tokens(text, model)
+
+
+# the same history is counted again for every turn of every participant
+@lru_cache(maxsize=16384)
+def _count_tokens(text: str, model: str) -> int:
+    if tiktoken is not None:
+        return len(_encoding(model).encode(text))
+    wide = sum(1 for c in text if ord(c) > 0x2e80)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def count_prompt_tokens(messages, model: str = "gpt-3.5-turbo") -> int:
+    """
+    prompt size of the serialized chat messages, as they are sent to openai
+    """
+    return TOKENS_PER_REPLY + sum(TOKENS_PER_MESSAGE + count_tokens(m["content"], model) for m in messages)
@@ -8,3 +8,70 @@ import openai
 #     "https": "http://localhost:9082",
 #     "http": "http://localhost:9082",
 # }
+
+# preset files, json or toml, a meeting in a later file replaces the one of the same name. edits are picked up live
+presets = ["./asset/preset.json", "./asset/preset.toml"]
+
+# validated participants of the latest started meetings (size of them), a new meeting copies them. the rooms
+# of the presets are prepared at startup
+meeting_pool = dict(size=32)
+
+# events a meeting keeps for the events tab, older ones are dropped
+event_log_size = 500
+
+# in meetings where the bots share the transcript, everything but the latest keep_recent messages is summarized
+# in the background, segment messages at a time, into minutes of at most max_tokens words that the bots read
+# instead. None turns it off
+rolling_summary = dict(segment=40, keep_recent=40, max_tokens=300, model=None, workers=2)
+
+# how many chat lines are sent back to the browser, older ones stay on the server
+chat_history_window = 200
+
+# tokens streamed to the browser are batched into one frame every interval seconds, or sooner once max_chars
+# of new text came in. None sends a frame per token
+stream_coalesce = dict(interval=0.05, max_chars=200)
+
+# check every chat request against the api schema before it is sent, slow, for debugging
+validate_requests = False
+
+# prompt tokens a bot may send per answer, older turns are dropped first. None means no limit
+context_token_budget = 3000
+
+# uncomment this line to cache identical chat requests, in memory and optionally on disk
+# response_cache = dict(max_entries=256, ttl=24 * 3600, disk_dir="./.cache/llm", max_disk_bytes=64 * 1024 * 1024)
+response_cache = None
+
+# seconds between two background connectivity probes
+health_check_interval = 60
+
+# prometheus metrics on http://<host>:<port>/metrics, None turns the endpoint off
+metrics_port = 8002
+
+# process wide openai limits shared by every meeting, None means no limit
+rate_limit = dict(requests_per_minute=3500, tokens_per_minute=90000)
+
+# at most max_inflight llm requests at once over every meeting and per_meeting of one meeting, the rest queue.
+# the participant the user waits on goes first, then the meetings take turns (a preset's "weight" is
+# its share), summaries go last. None sends every request right away
+scheduler = dict(max_inflight=64, per_meeting=8)
+
+# jittered exponential backoff for 429, timeouts and 5xx. budget_ratio is how many retries a request earns
+retry = dict(max_attempts=5, base_delay=0.5, max_delay=20, budget_ratio=0.2)
+
+# uncomment these lines to spread the calls over several keys or endpoints. a backend with a model only serves
+# that model, a participant may pin one with "backend": "<name>" and/or "model": "<model>" in preset.json
+# backends = [
+#     dict(name="team-a", api_key="<YOUR API KEY>", api_base="https://api.openai.com/v1", weight=2),
+#     dict(name="team-b", api_key="<ANOTHER KEY>", api_base="http://localhost:9083/v1", model="gpt-3.5-turbo"),
+# ]
+backends = []
+
+# uncomment this line to keep meetings on disk, so they survive a restart and can be resumed by their id
+# meeting_store = dict(root="./data/meetings", resident_messages=500, fsync_batch=32, fsync_interval=1.0)
+meeting_store = None
+
+# live meetings in memory. one idle for idle_ttl seconds is dropped, so are the least recently used ones past
+# max_meetings or max_bytes (None means no cap). with a meeting_store a meeting's state is saved next to its
+# messages after every round and it comes back when its id is used again, in the same room only. spill saves it
+# once more when it is dropped
+sessions = dict(idle_ttl=1800, max_meetings=200, max_bytes=1024 * 1024 * 1024, spill=True)
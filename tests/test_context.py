@@ -0,0 +1,58 @@
+from service.context import fit_context
+from service.tokens import count_prompt_tokens
+
+
+def conversation(turns, words=20):
+    system = dict(role="system", content="you are a helpful bot in a meeting")
+    return [system] + [dict(role="user", content=f"turn {i} " + "word " * words) for i in range(turns)]
+
+
+def test_no_budget_keeps_everything():
+    messages = conversation(50)
+    assert fit_context(messages, None) is messages
+    assert fit_context(messages, 0) is messages
+    assert fit_context([], 100) == []
+
+
+def test_fits_untouched():
+    messages = conversation(3)
+    assert fit_context(messages, 10000) is messages
+
+
+def test_keeps_system_and_latest_turns():
+    messages = conversation(100)
+    fitted = fit_context(messages, 500)
+    assert fitted[0] is messages[0]
+    assert "earlier messages are omitted" in fitted[1]["content"]
+    kept = fitted[2:]
+    # the latest turns, in order
+    assert kept == messages[-len(kept):]
+    assert count_prompt_tokens(fitted) <= 500
+
+
+def test_reserve_is_left_free():
+    messages = conversation(100)
+    fitted = fit_context(messages, 500, reserve=200)
+    assert count_prompt_tokens(fitted) <= 300
+    assert len(fitted) < len(fit_context(messages, 500))
+
+
+def test_latest_turn_too_long_is_cut_from_the_head():
+    messages = conversation(2, words=2000)
+    fitted = fit_context(messages, 200)
+    assert len(fitted) == 2
+    assert fitted[0] is messages[0]
+    assert messages[-1]["content"].endswith(fitted[1]["content"])
+    assert count_prompt_tokens(fitted) <= 200
+
+
+def test_pinned_messages_are_kept():
+    messages = conversation(100)
+    minutes = dict(role="user", content="(minutes of messages 0-80 of this meeting)\n" + "agreed " * 50)
+    messages.insert(1, minutes)
+    fitted = fit_context(messages, 500, pinned=2)
+    assert fitted[:2] == messages[:2]
+    assert fitted[-1] is messages[-1] and len(fitted) < len(messages)
+    assert count_prompt_tokens(fitted) <= 500
+    # without pinning the minutes are the oldest turn, the first one to go
+    assert minutes not in fit_context(messages, 500)
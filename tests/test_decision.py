@@ -0,0 +1,63 @@
+from service.decision import DecisionStream, parse_decision
+
+FIELDS = {"next": "玛丽", "reason": "她最懂", "question": "你怎么看?"}
+
+
+def stream(text, size=1):
+    decision = DecisionStream()
+    completed = []
+    for i in range(0, len(text), size):
+        completed += decision.feed(text[i:i + size])
+    return decision, completed
+
+
+def test_strict_json():
+    assert parse_decision('{"next":"玛丽","reason":"她最懂","question":"你怎么看?"}') == FIELDS
+
+
+def test_fields_complete_while_streaming():
+    decision, completed = stream('{"next":"玛丽","reason":"她最懂","question":"你怎么看?"}')
+    assert completed == ["next", "reason", "question"]
+    assert decision.done and decision.fields == FIELDS
+
+
+def test_code_fence_and_text_around():
+    text = '好的,我的决定是:\n```json\n{"next": "玛丽", "reason": "她最懂", "question": "你怎么看?"}\n```\n就这样'
+    assert parse_decision(text) == FIELDS
+
+
+def test_single_curly_quotes_and_separators():
+    assert parse_decision("{'next'：'玛丽', 'reason'; '她最懂', 'question'= '你怎么看?'}") == FIELDS
+    assert parse_decision('{“next”:“玛丽”,“reason”:“她最懂”,“question”:“你怎么看?”}') == FIELDS
+
+
+def test_full_width_comma_between_fields():
+    assert parse_decision('{"next":"玛丽"，"reason":"她最懂"，"question":"你怎么看?"}') == FIELDS
+
+
+def test_unescaped_quotes_inside_a_value():
+    fields = parse_decision('{"next":"玛丽","reason":"r","question":"你觉得"方案A"，怎么样"}')
+    assert fields["question"] == '你觉得"方案A"，怎么样'
+    fields = parse_decision('{"next":"a","reason":"he said "yes", fine","question":"q"}')
+    assert fields == {"next": "a", "reason": 'he said "yes", fine', "question": "q"}
+
+
+def test_escaped_quotes_and_newlines():
+    fields = parse_decision('{"next":"a","reason":"say \\"hi\\"\\nthen go",\n"question":"q"')
+    assert fields["reason"] == 'say "hi"\nthen go'
+
+
+def test_bare_values_and_trailing_comma():
+    assert parse_decision('{"next": 玛丽, "reason": "她最懂", "question": "你怎么看?",}') == FIELDS
+
+
+def test_cut_off_reply():
+    decision, completed = stream('{"next":"玛丽","reason":"她最懂","question":"你怎么', size=3)
+    assert "question" not in decision.fields
+    assert decision.finish() == ["question"]
+    assert decision.fields["question"] == "你怎么"
+
+
+def test_next_is_known_before_the_question():
+    decision, completed = stream('{"next":"玛丽","reason":"她')
+    assert completed == ["next"] and decision.fields["next"] == "玛丽"
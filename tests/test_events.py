@@ -0,0 +1,34 @@
+from service.events import EventLog
+
+
+def test_since_by_cursor():
+    log = EventLog(maxlen=10)
+    assert log.since(0) == ([], 0, 0)
+    for i in range(3):
+        assert log.append("e", str(i)) == i + 1
+    events, cursor, dropped = log.since(0)
+    assert [e["result"] for e in events] == ["0", "1", "2"] and cursor == 3 and dropped == 0
+    log.append("e", "3")
+    events, cursor, dropped = log.since(cursor)
+    assert [e["result"] for e in events] == ["3"] and cursor == 4
+    assert log.since(cursor) == ([], 4, 0)
+
+
+def test_dropped_events_are_counted():
+    log = EventLog(maxlen=5)
+    for i in range(12):
+        log.append("e", str(i))
+    events, cursor, dropped = log.since(2)
+    # 3..7 fell off the front
+    assert [e["seq"] for e in events] == [8, 9, 10, 11, 12] and dropped == 5 and cursor == 12
+    assert len(log) == 5
+
+
+def test_load_numbers_old_spills():
+    log = EventLog()
+    log.load([{"event": "a", "result": "1"}, {"event": "b", "result": "2"}])
+    assert [e["seq"] for e in log] == [1, 2]
+    assert log.append("c", "3") == 3
+    again = EventLog()
+    again.load(log.dump())
+    assert again.seq == 3 and again.since(2)[0][0]["event"] == "c"
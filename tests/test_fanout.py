@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from service.fanout import FanOut, fan_out
+
+
+async def words(name, n, delay=0.005):
+    for i in range(n):
+        await asyncio.sleep(delay)
+        yield f"{name}{i}"
+
+
+def test_interleaves_every_stream():
+    got = [d for d in fan_out([words("a", 5), words("b", 3)])]
+    assert [w for i, w in got if i == 0] == [f"a{i}" for i in range(5)]
+    assert [w for i, w in got if i == 1] == [f"b{i}" for i in range(3)]
+
+
+def test_error_is_raised():
+    async def broken():
+        yield "x"
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        list(fan_out([broken(), words("a", 100)]))
+
+
+def test_idle_ticks():
+    async def slow():
+        await asyncio.sleep(0.05)
+        yield "x"
+
+    got = list(fan_out([slow()], tick=0.01))
+    assert got[-1] == (0, "x") and got.count(None) >= 2
+
+
+def test_cancel_from_another_thread_closes_the_streams():
+    closed = []
+
+    async def endless(i):
+        try:
+            while True:
+                await asyncio.sleep(0.005)
+                yield "x"
+        finally:
+            closed.append(i)
+
+    fan = FanOut([endless(0), endless(1), words("short", 1)])
+    seen = 0
+    for delta in fan:
+        seen += 1
+        if seen == 5:
+            threading.Timer(0.01, fan.cancel).start()
+    assert fan.cancelled
+    # the short stream finished, the cancelled ones did not
+    assert fan.finished == [False, False, True]
+    assert sorted(closed) == [0, 1]
+
+
+def test_closing_the_iterator_stops_the_streams():
+    closed = []
+
+    async def endless():
+        try:
+            while True:
+                await asyncio.sleep(0.005)
+                yield "x"
+        finally:
+            closed.append(True)
+
+    deltas = fan_out([endless()])
+    next(deltas)
+    start = time.time()
+    deltas.close()
+    assert closed and time.time() - start < 1
@@ -0,0 +1,122 @@
+import threading
+import time
+
+from service.holder import ChatMessage
+from service.log import CHUNK, MessageLog, ViewCache
+from service.store import SegmentLog
+
+
+def message(i, name="a"):
+    return ChatMessage(user_name=name, content=f"message {i}")
+
+
+def filled(n, store=None, resident=500):
+    log = MessageLog(store, resident)
+    for i in range(n):
+        log.append(message(i, "ab"[i % 2]))
+    return log
+
+
+def contents(records):
+    return [r.content for r in records]
+
+
+def test_reads_across_chunks():
+    log = filled(3 * CHUNK + 7)
+    assert len(log) == 3 * CHUNK + 7
+    assert contents(log.records(CHUNK - 2, CHUNK + 3)) == [f"message {i}" for i in range(CHUNK - 2, CHUNK + 3)]
+    assert log.at(-1).content == f"message {3 * CHUNK + 6}"
+    assert contents(log.at(slice(0, 10, 3))) == ["message 0", "message 3", "message 6", "message 9"]
+
+
+def test_paged_out_records_come_back_from_the_store(tmp_path):
+    log = filled(5 * CHUNK, SegmentLog(tmp_path), resident=CHUNK)
+    offset, chunks = log.window
+    assert offset > 0
+    assert contents(log.records(0, 5 * CHUNK)) == [f"message {i}" for i in range(5 * CHUNK)]
+    assert log.record(3).content == "message 3"
+
+
+def test_flags_reach_paged_out_records(tmp_path):
+    log = filled(5 * CHUNK, SegmentLog(tmp_path), resident=CHUNK)
+    assert log.window[0] > 0
+    log.record(0).user_invisible = True
+    assert log.record(0).user_invisible
+    assert log.store.read(0)["user_invisible"] is True
+
+
+def test_view_cache_maps_only_new_records():
+    log = filled(10)
+    cache, calls = ViewCache(), []
+
+    def map_(record):
+        calls.append(record.i)
+        return record.content
+
+    assert len(log.get_msg_list(map_, cache=cache)) == 10
+    log.append(message(10))
+    assert log.get_msg_list(map_, cache=cache)[-1] == "message 10"
+    assert calls == list(range(11))
+
+
+def test_flag_flip_maps_again():
+    log = filled(10)
+    cache = ViewCache()
+    visible = lambda r: None if r.user_invisible else r.content
+    log.get_msg_list(visible, cache=cache)
+    log.record(4).user_invisible = True
+    view = log.get_msg_list(visible, cache=cache)
+    assert "message 4" not in view and len(view) == 9
+    assert cache.position(5) == 4
+
+
+def test_readers_see_whole_records_while_appending(tmp_path):
+    log = MessageLog(SegmentLog(tmp_path), resident=CHUNK)
+    errors, done = [], threading.Event()
+
+    def read():
+        while not done.is_set():
+            n = len(log)
+            got = contents(log.records(0, n))
+            if got != [f"message {i}" for i in range(n)]:
+                errors.append(n)
+
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    for t in readers:
+        t.start()
+    for i in range(4 * CHUNK):
+        log.append(message(i))
+    done.set()
+    for t in readers:
+        t.join()
+    assert not errors
+def test_filtered_view_follows_the_log():
+    log = filled(10)
+    view = log.filtered(lambda r: r.user_name == "a")
+    log.append(message(10, "a"))
+    log.append(message(11, "b"))
+    assert contents(view.get_msg_list()) == [f"message {i}" for i in range(0, 11, 2)]
+    assert view.at(-1).content == "message 10"
+
+
+def test_shared_cache_maps_every_record_once():
+    # the ui and a streaming round refresh the same participant's view at once
+    for view_of in (lambda log: log, lambda log: log.filtered(lambda r: True)):
+        log = filled(300)
+        view, cache = view_of(log), ViewCache()
+        results = []
+
+        def slow(record):
+            # let the other readers run in the middle of the walk
+            time.sleep(0)
+            return record.content
+
+        readers = [threading.Thread(target=lambda: results.append(view.get_msg_list(slow, cache=cache)))
+                   for _ in range(3)]
+        for t in readers:
+            t.start()
+        for t in readers:
+            t.join()
+        expected = [f"message {i}" for i in range(300)]
+        assert results == [expected] * 3
+        assert view.get_msg_list(lambda r: r.content, cache=cache) == expected
@@ -0,0 +1,47 @@
+import json
+import os
+
+import pytest
+
+from service.preset import PresetCatalog, merge_patch
+
+
+def test_merge_patch_rfc_7386():
+    target = {"a": "b", "c": {"d": "e", "f": "g"}, "list": [1, 2]}
+    patch = {"a": "z", "c": {"f": None, "h": 1}, "list": [3], "new": {"x": None}}
+    assert merge_patch(target, patch) == {"a": "z", "c": {"d": "e", "h": 1}, "list": [3], "new": {}}
+    # the target is left alone
+    assert target["c"] == {"d": "e", "f": "g"}
+    assert merge_patch({"a": 1}, "replaced") == "replaced"
+    assert merge_patch("scalar", {"a": 1}) == {"a": 1}
+    assert merge_patch({"a": 1}, {}) == {"a": 1}
+
+
+def meeting(names):
+    return dict(objective="test", who_am_i=dict(name="Rick"),
+                participants={n: dict(name=n, prompt=f"you are {n}") for n in names},
+                strategy=dict(type="roundrobin"), sequence=names)
+
+
+def test_catalog_overrides_and_reload(tmp_path):
+    path = tmp_path / "preset.json"
+    path.write_text(json.dumps({"meeting": {"room": meeting(["Alex", "Emma"])}}), encoding="utf-8")
+    catalog = PresetCatalog([str(path)], check_interval=0)
+    assert catalog.rooms() == ["room"]
+    base = catalog.get("room")
+    assert catalog.get("room") is base
+    patched = catalog.get("room", {"objective": "weekend", "participants": {"Emma": {"title": "cook"}}})
+    assert patched.preset.objective == "weekend" and patched.preset.participants["Emma"].title == "cook"
+    # a patch that leaves the sequence pointing at nobody does not validate
+    with pytest.raises(ValueError):
+        catalog.get("room", {"participants": {"Alex": None}})
+    with pytest.raises(KeyError):
+        catalog.get("nope")
+
+    # an edit is picked up at the next lookup, a broken one keeps the old presets
+    path.write_text(json.dumps({"meeting": {"other": meeting(["Liam"])}}), encoding="utf-8")
+    os.utime(path, (1, 1))
+    assert catalog.rooms() == ["other"]
+    path.write_text("{broken", encoding="utf-8")
+    os.utime(path, (2, 2))
+    assert catalog.rooms() == ["other"]
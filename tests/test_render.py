@@ -0,0 +1,31 @@
+import time
+
+from service.render import coalesce
+
+
+def frames(script):
+    """
+    script is a list of (text, seconds to wait before the frame), None text for an idle tick
+    """
+    for text, wait in script:
+        time.sleep(wait)
+        yield None if text is None else ([("bot", text)] if text else [])
+
+
+def test_small_tokens_are_batched():
+    script = [("a" * i, 0) for i in range(1, 50)] + [("", 0)]
+    out = list(coalesce(frames(script), interval=10, max_chars=20))
+    texts = [lines[0][1] if lines else "" for lines in out]
+    # one frame per 20 new characters, then the last text and the end of the round
+    assert texts == ["a" * 20, "a" * 40, "a" * 49, ""]
+
+
+def test_idle_tick_flushes_after_interval():
+    script = [("a", 0), ("ab", 0), (None, 0.06), (None, 0)]
+    out = list(coalesce(frames(script), interval=0.05, max_chars=1000))
+    assert out == [[("bot", "ab")]]
+
+
+def test_end_of_round_goes_out_at_once():
+    out = list(coalesce(frames([("hello", 0), ("", 0), ("next", 0), ("", 0)]), interval=10, max_chars=1000))
+    assert out == [[("bot", "hello")], [], [("bot", "next")], []]
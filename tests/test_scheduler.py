@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+from service import scheduler as scheduling
+from service.scheduler import BACKGROUND, NORMAL, WAITING, Scheduler
+
+
+def through(s, requests):
+    """
+    queue requests (name, priority, weight) behind a held slot of a one slot scheduler,
+    the names in the order they are let through
+    """
+    hold = s._enqueue("hold", 1, NORMAL, lambda: None)
+    order = []
+    waiters = [s._enqueue(name, weight, priority, lambda name=name: order.append(name))
+               for name, priority, weight in requests]
+    s.release(hold)
+    while granted := [w for w in waiters if w.granted]:
+        for w in granted:
+            waiters.remove(w)
+            s.release(w)
+    return order
+
+
+def test_priority_first():
+    s = Scheduler(max_inflight=1, per_meeting=10)
+    order = through(s, [("a", BACKGROUND, 1), ("b", NORMAL, 1), ("c", WAITING, 1)])
+    assert order == ["c", "b", "a"]
+    assert not s.flows and s.inflight == 0 and s.depth == [0, 0, 0]
+
+
+def test_meetings_take_turns():
+    s = Scheduler(max_inflight=1, per_meeting=10)
+    # the big meeting queued all of its requests first
+    order = through(s, [("big", NORMAL, 1)] * 6 + [("small", NORMAL, 1)] * 2)
+    assert order == ["big", "small", "big", "small", "big", "big", "big", "big"]
+
+
+def test_weight_is_a_share():
+    s = Scheduler(max_inflight=1, per_meeting=10)
+    order = through(s, [("heavy", NORMAL, 2)] * 8 + [("light", NORMAL, 1)] * 8)
+    assert order[:9].count("heavy") == 6
+
+
+def test_caps_hold():
+    s = Scheduler(max_inflight=4, per_meeting=2)
+    lock = threading.Lock()
+    now, peak = {}, {}
+
+    def request(name):
+        waiter = s.acquire(name, 1, NORMAL)
+        with lock:
+            now[name] = now.get(name, 0) + 1
+            now["all"] = now.get("all", 0) + 1
+            for key in (name, "all"):
+                peak[key] = max(peak.get(key, 0), now[key])
+        time.sleep(0.01)
+        with lock:
+            now[name] -= 1
+            now["all"] -= 1
+        s.release(waiter)
+
+    threads = [threading.Thread(target=request, args=(name,)) for name in "abc" * 5]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak["all"] == 4
+    assert max(peak[name] for name in "abc") == 2
+    assert not s.flows and s.inflight == 0
+
+
+def test_cancel_while_queued():
+    s = Scheduler(max_inflight=1, per_meeting=1)
+
+    async def main():
+        held = await s.acquire_async("x", 1, NORMAL)
+        queued = [asyncio.ensure_future(s.acquire_async("y", 1, NORMAL)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        assert s.depth[NORMAL] == 3 and sorted(s.flows) == ["x", "y"]
+        for task in queued:
+            task.cancel()
+        await asyncio.gather(*queued, return_exceptions=True)
+        # nothing of y is left behind
+        assert s.depth[NORMAL] == 0 and sorted(s.flows) == ["x"]
+        s.release(held)
+
+    asyncio.run(main())
+    assert not s.flows and s.inflight == 0
+
+
+def test_scheduled_stream_holds_its_slot(monkeypatch):
+    s = Scheduler(max_inflight=1, per_meeting=1)
+    monkeypatch.setattr(scheduling, "scheduler", s)
+    started = []
+
+    async def stream(name):
+        started.append(name)
+        for _ in range(3):
+            await asyncio.sleep(0.01)
+            yield name
+
+    async def read(name):
+        return [delta async for delta in scheduling.scheduled(stream(name))]
+
+    async def main():
+        return await asyncio.gather(read("a"), read("b"))
+
+    assert asyncio.run(main()) == [["a"] * 3, ["b"] * 3]
+    assert started == ["a", "b"]
+    assert s.inflight == 0 and not s.flows
+
+
+def test_cancelled_stream_gives_its_slot_back(monkeypatch):
+    s = Scheduler(max_inflight=1, per_meeting=1)
+    monkeypatch.setattr(scheduling, "scheduler", s)
+
+    async def forever():
+        while True:
+            await asyncio.sleep(0.01)
+            yield "x"
+
+    async def main():
+        async def read():
+            async for _ in scheduling.scheduled(forever()):
+                pass
+
+        task = asyncio.ensure_future(read())
+        await asyncio.sleep(0.05)
+        assert s.inflight == 1
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert s.inflight == 0 and not s.flows
@@ -0,0 +1,41 @@
+import pytest
+
+import service.meeting
+import service.session
+from service.preset import catalog
+from service.session import RoomMismatch, SessionRegistry
+from service.store import MeetingStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = MeetingStore(root=str(tmp_path))
+    monkeypatch.setattr(service.meeting, "meeting_store", store)
+    monkeypatch.setattr(service.session, "meeting_store", store)
+    return store
+
+
+def test_resume_by_id_after_a_restart(store):
+    sessions = SessionRegistry(spill=False)
+    session = sessions.create("m1", catalog.get("有裁判的辩论"), room="有裁判的辩论")
+    session.holder.strategy.current = "Emma"
+    session.holder.strategy.score = [1, 2]
+    session.save()
+    store.close("m1")
+
+    # a new process: nothing live, nothing evicted, only the files
+    resumed = SessionRegistry(spill=False).create("m1", catalog.get("有裁判的辩论"), room="有裁判的辩论")
+    assert resumed is not session
+    assert resumed.holder.strategy.current == "Emma"
+    assert resumed.holder.strategy.score == [1, 2]
+    assert resumed.holder.holder_note.dump()[-1]["event"] == "session restored"
+
+
+def test_an_id_stays_in_its_room(store):
+    sessions = SessionRegistry()
+    sessions.create("m1", catalog.get("有裁判的辩论"), room="有裁判的辩论")
+    with pytest.raises(RoomMismatch):
+        sessions.create("m1", catalog.get("并发男友"), room="并发男友")
+    store.close("m1")
+    with pytest.raises(RoomMismatch):
+        SessionRegistry().create("m1", catalog.get("并发男友"), room="并发男友")
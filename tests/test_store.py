@@ -0,0 +1,57 @@
+from service.holder import ChatMessage
+from service.log import MessageLog
+from service.store import SegmentLog
+
+
+def fields(i):
+    return dict(user_name="a", content=f"message {i}", supplement=None, user_invisible=False, bot_invisible=False)
+
+
+def test_resume_reads_messages_and_patches(tmp_path):
+    store = SegmentLog(tmp_path, segment_size=4)
+    for i in range(10):
+        store.append(fields(i))
+    store.patch(2, "bot_invisible", True)
+    store.close()
+    # 10 messages and a patch, 4 lines to a segment
+    assert len(list(tmp_path.glob("*.jsonl"))) == 3
+
+    resumed = SegmentLog(tmp_path, segment_size=4)
+    assert len(resumed) == 10
+    assert [m["content"] for m in resumed.read_range(0, 10)] == [f"message {i}" for i in range(10)]
+    assert resumed.read(2)["bot_invisible"] is True
+    assert resumed.append(fields(10)) == 10
+    assert resumed.read(10)["content"] == "message 10"
+
+
+def test_torn_line_is_dropped(tmp_path):
+    store = SegmentLog(tmp_path)
+    for i in range(3):
+        store.append(fields(i))
+    store.close()
+    segment = next(tmp_path.glob("*.jsonl"))
+    with segment.open("ab") as f:
+        f.write(b'{"op": "msg", "user_name": "a", "cont')
+
+    resumed = SegmentLog(tmp_path)
+    assert len(resumed) == 3
+    # the next append starts on a clean line
+    resumed.append(fields(3))
+    resumed.close()
+    again = SegmentLog(tmp_path)
+    assert [m["content"] for m in again.read_range(0, 4)] == [f"message {i}" for i in range(4)]
+
+
+def test_message_log_resumes_from_the_store(tmp_path):
+    log = MessageLog(SegmentLog(tmp_path), resident=300)
+    for i in range(1000):
+        log.append(ChatMessage(user_name="a", content=f"message {i}"))
+    log.record(5).user_invisible = True
+    log.store.close()
+
+    resumed = MessageLog(SegmentLog(tmp_path), resident=300)
+    assert len(resumed) == resumed.resumed == 1000
+    assert resumed.window[0] > 0
+    assert [r.content for r in resumed.records(0, 1000)] == [f"message {i}" for i in range(1000)]
+    assert resumed.record(5).user_invisible
+    assert MessageLog().resumed == 0
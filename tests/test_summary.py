@@ -0,0 +1,53 @@
+import setting
+from service.holder import Bot, ChatMessage, ChatMessageList
+from service.log import MessageLog
+from service.summary import RollingSummary, rolling_summary
+
+
+def long_meeting(rounds):
+    msg_list = ChatMessageList()
+    bot = Bot(name="bot0", prompt="you are bot0, keep it short", msg_list=msg_list)
+    for i in range(rounds):
+        for name in ("bot0", "bot1", "bot2"):
+            msg_list[1](ChatMessage(user_name=name, content=f"round {i}: " + "这个方案需要再讨论一下细节. " * 15))
+    return bot, msg_list
+
+
+def test_minutes_survive_the_default_budget():
+    bot, msg_list = long_meeting(130)
+    summary = rolling_summary(msg_list[3], create=True)
+    summary.summaries[(0, 80)] = "everyone agreed on plan A"
+    summary.latest = (0, 80)
+    view = bot.view()
+    assert setting.context_token_budget
+    assert view[0]["role"] == "system"
+    assert view[1]["content"].startswith("(minutes of messages 0-80") and "plan A" in view[1]["content"]
+    # the budget still drops the older turns after the minutes
+    assert "earlier messages are omitted" in view[2]["content"]
+
+
+def test_first_summary_starts_at_zero_unless_resumed():
+    log = MessageLog()
+    for i in range(150):
+        log.append(ChatMessage(user_name="a", content=str(i)))
+    assert RollingSummary(log, segment=40, keep_recent=40).due() == (0, 40)
+    log.resumed = 150
+    assert RollingSummary(log, segment=40, keep_recent=40).due() == (40, 80)
+
+
+def test_rolls_forward_a_segment_at_a_time(monkeypatch):
+    log = MessageLog()
+    for i in range(130):
+        log.append(ChatMessage(user_name="a", content=str(i)))
+    summary = RollingSummary(log, segment=40, keep_recent=40)
+    calls = []
+
+    def summarize(previous, records):
+        calls.append((previous, records[0].i, records[-1].i))
+        return f"minutes up to {records[-1].i + 1}"
+
+    monkeypatch.setattr(summary, "summarize", summarize)
+    summary.running = True
+    summary._roll()
+    assert calls == [(None, 0, 39), ("minutes up to 40", 40, 79)]
+    assert summary.get() == (0, 80, "minutes up to 80")